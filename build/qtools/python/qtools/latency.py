@@ -0,0 +1,76 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import with_statement
+
+import commandant as _commandant
+import json as _json
+
+from .common import *
+
+_description = "Combine latency histograms"
+
+_epilog = """
+example usage:
+  $ qreceive queue0 --count 1000 --latency-output r1.json &
+  $ qreceive queue0 --count 1000 --latency-output r2.json &
+  $ qmessage --count 2000 | qsend queue0 --timestamp
+  $ qlatency r1.json r2.json
+"""
+
+class LatencyCommand(_commandant.Command):
+    def __init__(self, home_dir):
+        super(LatencyCommand, self).__init__(home_dir, "qlatency")
+
+        self.description = _description
+        self.epilog = _epilog
+
+        self.add_argument("file", metavar="FILE", nargs="+",
+                          help="A histogram file written by the --latency-output option of qreceive or qrequest")
+        self.add_argument("--json", action="store_true",
+                          help="Print the combined percentiles in JSON format")
+
+    def init(self):
+        super(LatencyCommand, self).init()
+
+        self.files = self.args.file
+        self.json_enabled = self.args.json
+
+    def run(self):
+        total = LatencyHistogram()
+
+        for file in self.files:
+            try:
+                with open(file, "r") as f:
+                    histogram = LatencyHistogram.from_data(_json.load(f))
+            except (IOError, ValueError, KeyError) as e:
+                self.fail("Failed to load histogram from '{}': {}", file, e)
+
+            total.merge(histogram)
+
+        summary = total.summary()
+
+        if self.json_enabled:
+            print(_json.dumps(summary))
+        else:
+            print("Count {}, {}".format(summary["count"], format_latency(summary)))
@@ -0,0 +1,228 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import with_statement
+
+import os as _os
+import proton as _proton
+import proton.reactor as _reactor
+import sys as _sys
+
+from .common import *
+
+_description = "Receive AMQP messages"
+
+_epilog = """
+example usage:
+  $ qreceive //example.net/queue0
+  $ qreceive queue0 queue1 > messages.txt
+  $ qreceive queue0 --format amqp > messages.amqp
+"""
+
+class ReceiveCommand(MessagingCommand):
+    def __init__(self, home_dir):
+        super(ReceiveCommand, self).__init__(home_dir, "qreceive", _Handler(self))
+
+        self.description = _description
+        self.epilog = url_epilog + _epilog
+
+        self.add_link_arguments()
+        self.add_latency_arguments("end-to-end")
+
+        self.add_argument("--output", metavar="FILE",
+                          help="Write messages to FILE (default stdout)")
+        self.add_argument("--format", metavar="FORMAT",
+                          choices=("text", "json", "amqp"), default="text",
+                          help="Write messages in FORMAT: text, json, or amqp (default text).  "
+                          "The amqp format is the encoded message with a length prefix.")
+        self.add_argument("--json", action="store_true",
+                          help="Write messages in JSON format (same as --format json)")
+        self.add_argument("--annotations", action="store_true",
+                          help="Print delivery and message annotations")
+        self.add_argument("--properties", action="store_true",
+                          help="Print message application properties")
+        self.add_argument("--router-trace", action="store_true",
+                          help="Print the list of routers the message passed through")
+        self.add_argument("--no-prefix", action="store_true",
+                          help="Suppress address prefix")
+        self.add_argument("-c", "--count", metavar="COUNT", type=int,
+                          help="Exit after receiving COUNT messages")
+
+    def init(self):
+        super(ReceiveCommand, self).init()
+
+        self.init_link_attributes()
+
+        self.output_format = self.args.format
+
+        if self.args.json:
+            self.output_format = "json"
+
+        self.json_enabled = self.output_format == "json"
+        self.annotations_enabled = self.args.annotations
+        self.properties_enabled = self.args.properties
+        self.router_trace_enabled = self.args.router_trace
+        self.prefix_disabled = self.args.no_prefix
+        self.max_count = self.args.count
+
+        if self.args.latency_output is not None and self.output_format == "amqp":
+            self.fail("The amqp output format does not decode messages, so latency cannot be measured")
+
+        self.init_latency_attributes()
+
+        if self.output_format == "amqp":
+            if self.annotations_enabled or self.properties_enabled or self.router_trace_enabled:
+                self.fail("The amqp output format cannot be combined with "
+                          "--annotations, --properties, or --router-trace")
+
+            self.output_file = binary_file(self.output_file)
+
+        if self.args.output is not None:
+            mode = "wb" if self.output_format == "amqp" else "w"
+            self.output_file = open(self.args.output, mode)
+
+    def run(self):
+        self.output_thread.start()
+
+        try:
+            super(ReceiveCommand, self).run()
+        except KeyboardInterrupt:
+            self.report_latency("End-to-end")
+            raise
+
+class _Handler(LinkHandler):
+    def __init__(self, command):
+        super(_Handler, self).__init__(command)
+
+        self.received_messages = 0
+
+    def open_links(self, event, connection, address):
+        return event.container.create_receiver(connection, address),
+
+    def on_delivery(self, event):
+        # In amqp format, take the encoded bytes before the default
+        # incoming message handler decodes them
+
+        super(_Handler, self).on_delivery(event)
+
+        if self.command.output_format != "amqp":
+            return
+
+        delivery = event.delivery
+
+        if delivery.aborted or not delivery.readable or delivery.partial:
+            return
+
+        data = receive_encoded_message(delivery)
+
+        self.accept(delivery)
+
+        if self.done_receiving:
+            return
+
+        self.received_messages += 1
+
+        self.command.output_thread.push_line(encode_frame(data))
+
+        if self.command.verbose:
+            self.command.info("Received {} from {} on {}",
+                              delivery,
+                              event.link.source,
+                              event.connection)
+
+        self.check_done(event)
+
+    def on_message(self, event):
+        if self.done_receiving:
+            return
+
+        self.received_messages += 1
+
+        message = event.message
+        extra_info = False
+
+        self.command.stats.record_latency(message)
+
+        if self.command.annotations_enabled:
+            if message.instructions is not None:
+                for name in sorted(message.instructions):
+                    value = message.instructions[name]
+                    self.write_line("[delivery annotation] {}: {}", name, value)
+
+            if message.annotations is not None:
+                for name in sorted(message.annotations):
+                    value = message.annotations[name]
+                    self.write_line("[message annotation] {}: {}", name, value)
+
+        if self.command.properties_enabled:
+            if message.properties is not None:
+                for name in sorted(message.properties):
+                    value = message.properties[name]
+                    self.write_line("[property] {}: {}", name, value)
+
+        if self.command.router_trace_enabled:
+            value = message.annotations.get("x-opt-qd.trace")
+            value = ", ".join(value)
+
+            if value is not None:
+                self.write_line("[router trace] {}", value)
+
+        out = list()
+
+        if not self.command.prefix_disabled:
+            prefix = event.link.source.address + ": "
+            out.append(prefix)
+
+        if self.command.json_enabled:
+            out.append(self.command.codec.encode(message))
+        else:
+            out.append(format_body(message.body))
+
+        self.command.output_thread.push_line("".join(out))
+
+        if self.command.verbose:
+            self.command.info("Received {} from {} on {}",
+                              message,
+                              event.link.source,
+                              event.connection)
+
+        self.check_done(event)
+
+    def check_done(self, event):
+        if self.received_messages == self.command.max_count:
+            self.command.output_thread.push_line(DONE)
+            self.done_receiving = True
+            self.close(event)
+
+    def close(self, event):
+        super(_Handler, self).close(event)
+
+        self.command.notice("Received {} {}",
+                            self.received_messages,
+                            plural("message", self.received_messages))
+
+        self.command.report_latency("End-to-end")
+
+    def write_line(self, template="", *args):
+        line = template.format(*args)
+        self.command.output_thread.push_line(line)
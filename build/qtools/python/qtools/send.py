@@ -0,0 +1,255 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import with_statement
+
+import collections as _collections
+import proton as _proton
+import proton.reactor as _reactor
+import sys as _sys
+import threading as _threading
+
+from .common import *
+from .message import MessageGenerator, add_generator_arguments, generator_options_used
+
+_description = "Send AMQP messages"
+
+_epilog = """
+generated messages:
+  With --generate, qsend builds messages itself instead of reading
+  them, using the field, template, and payload options of qmessage.
+  The message ID option is --message-id, since --id sets the container
+  identity.  Without --rate, --count defaults to 1.  Unlike qmessage,
+  qsend can generate binary bodies without the amqp format.  qreceive
+  prints binary bodies that aren't UTF-8 as base64.
+
+example usage:
+  $ qsend //example.net/queue0 -m abc -m xyz
+  $ qsend queue0 queue1 < messages.txt
+  $ qsend queue0 --format amqp < messages.amqp
+  $ qmessage --count 100000 | qsend queue0 --rate 1000 --stats-interval 1
+  $ qsend queue0 --generate --count 100000 --body-size 1024
+  $ qsend queue0 --generate --rate 1000 --subject 'order-{seq}' --stats-interval 1
+"""
+
+class SendCommand(MessagingCommand):
+    def __init__(self, home_dir):
+        super(SendCommand, self).__init__(home_dir, "qsend", _Handler(self))
+
+        self.description = _description
+        self.epilog = url_epilog + _epilog
+
+        self.add_link_arguments()
+        self.add_rate_arguments()
+
+        self.add_argument("-m", "--message", metavar="CONTENT",
+                          action="append", default=list(),
+                          help="Send a message containing CONTENT.  This option can be repeated.")
+        self.add_argument("--input", metavar="FILE",
+                          help="Read messages from FILE, one per line (default stdin)")
+        self.add_argument("--format", metavar="FORMAT",
+                          choices=("text", "amqp"), default="text",
+                          help="Read messages in FORMAT: text or amqp (default text).  "
+                          "The amqp format is the output of 'qreceive --format amqp'.")
+        self.add_argument("--presettled", action="store_true",
+                          help="Send messages fire-and-forget (at-most-once delivery)")
+        self.add_argument("--timestamp", action="store_true",
+                          help="Stamp each message with its send time, for latency measurement by qreceive")
+        self.add_argument("--generate", action="store_true",
+                          help="Generate messages instead of reading them")
+        self.add_argument("-c", "--count", metavar="COUNT", type=int,
+                          help="With --generate, exit after sending COUNT messages "
+                          "(default 1, or no limit with --rate)")
+
+        add_generator_arguments(self, id_option="--message-id")
+
+    def init(self):
+        super(SendCommand, self).init()
+
+        self.init_link_attributes()
+        self.init_rate_attributes()
+
+        self.presettled = self.args.presettled
+        self.input_format = self.args.format
+        self.timestamps_enabled = self.args.timestamp
+        self.generator = None
+
+        if self.args.generate:
+            self.init_generator()
+        elif self.args.count is not None or generator_options_used(self):
+            self.fail("The --count and message field options require --generate")
+
+        if self.input_format == "amqp":
+            if self.args.message:
+                self.fail("The --message option cannot be used with the amqp input format")
+
+            if self.timestamps_enabled:
+                self.fail("The --timestamp option cannot be used with the amqp input format")
+
+            self.input_file = binary_file(self.input_file)
+
+        if self.args.input is not None:
+            mode = "rb" if self.input_format == "amqp" else "r"
+            self.input_file = open(self.args.input, mode)
+
+        if self.args.message:
+            for value in self.args.message:
+                self.input_thread.push_line(value)
+
+            self.input_thread.push_line(DONE)
+
+    def init_generator(self):
+        if self.args.message or self.args.input is not None or self.input_format == "amqp":
+            self.fail("The --generate option cannot be used with --message, --input, or the amqp input format")
+
+        self.generator = MessageGenerator(self)
+        self.max_count = self.args.count
+
+        if self.max_count is None:
+            self.max_count = 1 if self.rate is None else -1
+
+        # Without --to, each message goes to its sender's target
+        self.generated_address = self.args.to is None
+
+    def run(self):
+        if self.generator is None:
+            self.input_thread.start()
+
+        super(SendCommand, self).run()
+
+class _Handler(LinkHandler):
+    def __init__(self, command):
+        super(_Handler, self).__init__(command)
+
+        self.sent_messages = 0
+        self.settled_messages = 0
+
+    def open_links(self, event, connection, address):
+        options = None
+
+        if self.command.presettled:
+            options = _reactor.AtMostOnce()
+
+        sender = event.container.create_sender(connection, address, options=options)
+
+        self.senders.appendleft(sender)
+
+        return sender,
+
+    def on_input(self, event):
+        self.send_messages(event)
+
+    def on_sendable(self, event):
+        self.send_messages(event)
+
+    def send_message(self, event, sender):
+        if not self.command.ready.is_set():
+            return False
+
+        if self.done_sending:
+            return False
+
+        if not sender.credit:
+            return False
+
+        if not self.message_due():
+            return False
+
+        if self.command.generator is not None:
+            if self.sent_messages == self.command.max_count:
+                line = DONE
+            else:
+                line = None
+        else:
+            try:
+                line = self.command.input_thread.lines.pop()
+            except IndexError:
+                return False
+
+        if line is DONE:
+            self.done_sending = True
+
+            if self.command.presettled or self.sent_messages == self.settled_messages:
+                self.close(event)
+
+            return False
+
+        send_time = None
+
+        if self.schedule is not None:
+            send_time = self.schedule.advance()
+
+        if self.command.input_format == "amqp":
+            delivery = self.transfer(sender, line, send_time)
+
+            self.sent_messages += 1
+
+            if self.command.verbose:
+                self.command.info("Sent encoded message as {} to {} on {}",
+                                  delivery,
+                                  sender.target,
+                                  sender.connection)
+
+            return True
+
+        if line is None:
+            message = self.command.generator.create_message(self.sent_messages + 1)
+
+            if self.command.generated_address:
+                message.address = sender.target.address
+        else:
+            message = self.command.codec.decode(line)
+
+            if message.address is None:
+                message.address = sender.target.address
+
+        if self.command.timestamps_enabled:
+            stamp_send_time(message, send_time)
+
+        delivery = self.transfer(sender, message, send_time)
+
+        self.sent_messages += 1
+
+        if self.command.verbose:
+            self.command.info("Sent {} as {} to {} on {}",
+                              message,
+                              delivery,
+                              sender.target,
+                              sender.connection)
+
+        return True
+
+    def on_settled(self, event):
+        super(_Handler, self).on_settled(event)
+
+        self.settled_messages += 1
+
+        if self.done_sending and self.sent_messages == self.settled_messages:
+            self.close(event)
+
+    def close(self, event):
+        super(_Handler, self).close(event)
+
+        self.command.notice("Sent {} {}",
+                            self.sent_messages,
+                            plural("message", self.sent_messages))
@@ -0,0 +1,462 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+import argparse
+import json
+import sys
+import time
+
+from plano import *
+
+def open_test_session(session):
+    set_message_threshold("error")
+
+def start_qmessage(args, **kwargs):
+    return start_process("qmessage --verbose {}", args, **kwargs)
+
+def start_qsend(url, args, **kwargs):
+    return start_process("qsend --verbose {} {}", url, args, **kwargs)
+
+def start_qreceive(url, args, **kwargs):
+    return start_process("qreceive --verbose {} {}", url, args, **kwargs)
+
+def start_qrequest(url, args, **kwargs):
+    return start_process("qrequest --verbose {} {}", url, args, **kwargs)
+
+def start_qrespond(url, args, **kwargs):
+    return start_process("qrespond --verbose {} {}", url, args, **kwargs)
+
+def send_and_receive(url, qmessage_args="", qsend_args="", qreceive_args="--count 1"):
+    message_proc = start_qmessage(qmessage_args, stdout=PIPE)
+    send_proc = start_qsend(url, qsend_args, stdin=message_proc.stdout)
+    receive_proc = start_qreceive(url, qreceive_args, stdout=PIPE)
+
+    try:
+        check_process(message_proc)
+        check_process(send_proc)
+        check_process(receive_proc)
+    except CalledProcessError:
+        terminate_process(message_proc)
+        terminate_process(send_proc)
+        terminate_process(receive_proc)
+
+        raise
+
+    output = receive_proc.communicate()[0].decode()
+
+    return output[:-1]
+
+def request_and_respond(url, qmessage_args="", qrequest_args="", qrespond_args="--count 1"):
+    message_proc = start_qmessage(qmessage_args, stdout=PIPE)
+    request_proc = start_qrequest(url, qrequest_args, stdin=message_proc.stdout, stdout=PIPE)
+    respond_proc = start_qrespond(url, qrespond_args)
+
+    try:
+        check_process(message_proc)
+        check_process(request_proc)
+        check_process(respond_proc)
+    except CalledProcessError:
+        terminate_process(message_proc)
+        terminate_process(request_proc)
+        terminate_process(respond_proc)
+
+        raise
+
+    output = request_proc.communicate()[0].decode()
+
+    return output[:-1]
+
+class TestServer(object):
+    def __init__(self, args="", port=None):
+        if port is None:
+            port = random_port()
+
+        self.proc = start_process("qbroker --quiet --port {} {}", port, args)
+        self.proc.port = port
+        self.proc.url = "//127.0.0.1:{}/q0".format(port)
+
+    def __enter__(self):
+        return self.proc
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        stop_process(self.proc)
+
+def test_send_receive(session):
+    with TestServer() as server:
+        body = send_and_receive(server.url, "--body abc123", "", "--count 1 --no-prefix")
+        assert body == "abc123", body
+
+        send_and_receive(server.url, "", "--presettled")
+        send_and_receive(server.url, "", "-m abc --message xyz", "--count 2")
+        send_and_receive(server.url, "--count 10", "", "--count 10")
+        send_and_receive(server.url, "--count 10 --rate 1000", "", "--count 10")
+        send_and_receive(server.url, "--count 10 --rate 100", "--stats-interval 0.05", "--count 10 --stats-interval 0.05")
+        send_and_receive(server.url, "--count 10", "--rate 200", "--count 10")
+
+        call("qsend --verbose {} --generate --count 10 --subject 's-{{seq}}' --body-size 100 --seed 1", server.url)
+
+        lines = call_for_output("qreceive --verbose {} --count 10 --no-prefix", server.url).decode().splitlines()
+        assert len(lines) == 10, lines
+        assert all(len(x) == 100 for x in lines), lines
+
+        call("qsend --verbose {} --generate --count 10 --rate 1000 --body-size 100 --body-content binary", server.url)
+        call("qreceive --verbose {} --count 10 --format amqp --output {}", server.url, make_temp_file())
+
+        # Binary bodies that aren't UTF-8 print as base64
+        call("qsend --verbose {} --generate --body-size 10 --body-content binary --seed 1", server.url)
+
+        body = call_for_output("qreceive --verbose {} --count 1 --no-prefix", server.url).decode()[:-1]
+        assert len(body) == 16, body
+
+        call("qsend --verbose {} --generate --body-size 10 --body-content binary --seed 1", server.url)
+
+        output = call_for_output("qreceive --verbose {} --count 1 --no-prefix --json", server.url)
+        data = json.loads(output.decode())
+        assert len(data["body"]) == 16, data
+
+        proc = start_process("qsend --verbose {} -m abc --log-format json", server.url, stderr=PIPE)
+        records = [json.loads(x) for x in proc.communicate()[1].decode().splitlines()]
+        assert proc.returncode == 0, proc.returncode
+        assert records[-1]["level"] == "notice", records
+        assert any(x["level"] == "info" for x in records), records
+
+        call("qreceive --verbose {} --count 1", server.url)
+
+        call("qsend --verbose {0}-a {0}-b {0}-c --generate --count 6 --links-per-connection 2", server.url)
+        call("qreceive --verbose {0}-a {0}-b {0}-c --count 6", server.url)
+
+def test_transport_options(session):
+    with TestServer("--max-frame-size 16384 --session-window 1000000 --idle-timeout 10") as server:
+        send_and_receive(server.url, "--count 10 --body-size 10000", "--max-frame-size 4096 --idle-timeout 10",
+                         "--count 10 --max-frame-size 1024 --session-window 65536")
+        send_and_receive(server.url, "--count 10", "--socket-send-buffer 65536 --socket-receive-buffer 65536",
+                         "--count 10 --socket-receive-buffer 65536")
+
+def test_reconnect(session):
+    from qtools.common import ReconnectBackoff
+
+    gave_up = list()
+    backoff = ReconnectBackoff(3, 0.1, 0.15, lambda: gave_up.append(True))
+
+    # Newer Proton iterates the backoff
+
+    delays = list(backoff)
+    assert len(delays) == 3, delays
+    assert delays[0] == 0, delays
+    assert 0.05 <= delays[1] <= 0.1, delays
+    assert 0.075 <= delays[2] <= 0.15, delays
+    assert len(gave_up) == 1, gave_up
+
+    # Older Proton calls reset() and next()
+
+    for i in range(2):
+        backoff.reset()
+
+        delays = [backoff.next() for x in range(3)]
+        assert delays[0] == 0, delays
+        assert 0.05 <= delays[1] <= 0.1, delays
+
+        try:
+            backoff.next()
+        except StopIteration:
+            pass
+        else:
+            raise Exception("The backoff didn't stop")
+
+    assert len(gave_up) == 3, gave_up
+
+    with TestServer() as server:
+        servers = "--server 127.0.0.1:{} --server 127.0.0.1:{}".format(random_port(), server.port)
+
+        send_and_receive("q0", "--count 10", servers, "--count 10 {}".format(servers))
+        request_and_respond("q0", "--count 10", servers, "--count 10 {}".format(servers))
+
+    port = random_port()
+
+    with TestServer(port=port) as server:
+        receive_proc = start_qreceive(server.url, "--count 2")
+        call("qsend --verbose {} -m abc", server.url)
+        sleep(0.5)
+
+    with TestServer(port=port) as server:
+        call("qsend --verbose {} -m xyz", server.url)
+        check_process(receive_proc)
+
+    try:
+        call("qsend --verbose //127.0.0.1:{}/q0 -m abc --reconnect-attempts 2 --reconnect-delay 0.01", random_port())
+    except CalledProcessError:
+        pass
+    else:
+        raise Exception("qsend didn't give up")
+
+def test_request_respond(session):
+    with TestServer() as server:
+        body = request_and_respond(server.url, "--body abc123", "--no-prefix", "--count 1 --reverse --upper --append ' and this'")
+        assert body == "321CBA and this", body
+
+        request_and_respond(server.url, "", "--presettled")
+        request_and_respond(server.url, "", "-m abc --message xyz", "--count 2")
+        request_and_respond(server.url, "--count 10", "", "--count 10")
+        request_and_respond(server.url, "--count 10 --rate 1000", "", "--count 10")
+        request_and_respond(server.url, "--count 10", "--max-outstanding 2 --timeout 10", "--count 10")
+        request_and_respond(server.url, "--count 10", "--rate 200", "--count 10")
+        request_and_respond(server.url, "--count 10", "--shared-reply", "--count 10")
+        request_and_respond(server.url, "--count 10", "", "--count 10 --workers 4")
+        request_and_respond(server.url, "--count 10 --body abc", "", "--count 10 --cache-size 2 --cache-ttl 10 --stats-interval 0.05")
+
+        # Identical binary requests share a cache entry
+        respond_proc = start_qrespond(server.url, "--count 2 --cache-size 2", stderr=PIPE)
+
+        for i in range(2):
+            call("qrequest --verbose {} --generate --body-size 10 --body-content binary --seed 1", server.url)
+
+        output = respond_proc.communicate()[1].decode()
+        assert respond_proc.returncode == 0, output
+        assert "Cache hits 1, misses 1" in output, output
+        request_and_respond(server.url, "--count 10", "--max-outstanding 1", "--count 10 --reply-senders 1 --reply-sender-idle 0.1")
+
+        body = request_and_respond(server.url, "--body abc", "--no-prefix", "--count 1 --workers 2 --pool process --upper")
+        assert body == "ABC", body
+
+        respond_proc = start_qrespond(server.url, "--count 10")
+        call("qrequest --verbose {} --generate --count 10 --property key '{{seq % 3}}' --max-outstanding 2", server.url)
+        check_process(respond_proc)
+
+        respond_proc = start_qrespond(server.url, "--count 2 --upper")
+        call("qrequest --verbose {} --generate --count 2 --body-size 10 --body-content binary --json", server.url)
+        check_process(respond_proc)
+
+        respond_proc = start_qrespond("{0}-a {0}-b".format(server.url), "--count 10")
+        call("qrequest --verbose {0}-a {0}-b --generate --count 10 --shared-reply", server.url)
+        check_process(respond_proc)
+
+        # No responder, so both requests time out after one retry
+        call("qrequest --verbose {}-none -m abc -m xyz --timeout 0.1 --retries 1", server.url, stdin=PIPE)
+
+        # Requests with duplicate IDs each get their response
+        output = request_and_respond(server.url, "--id fixed --count 3", "", "--count 3")
+        assert len(output.splitlines()) == 3, output
+
+        # Responses that echo the request's correlation ID
+        config_file = make_temp_file()
+        write(config_file, _correlation_config)
+
+        output = request_and_respond(server.url, "--count 3", "--timeout 10", "--count 3 --config {}".format(config_file))
+        assert len(output.splitlines()) == 3, output
+
+        output = request_and_respond(server.url, "--id fixed --correlation-id abc --count 3", "--timeout 10",
+                                     "--count 3 --config {}".format(config_file))
+        assert len(output.splitlines()) == 3, output
+
+_correlation_config = """
+def process(request, response):
+    response.correlation_id = request.correlation_id
+    response.body = request.body
+"""
+
+_batch_config = """
+def process_batch(requests, responses):
+    for request, response in zip(requests, responses):
+        response.body = "{} of {}".format(request.body, len(requests))
+"""
+
+def test_respond_batch(session):
+    with TestServer() as server:
+        config_file = make_temp_file()
+        write(config_file, _batch_config)
+
+        body = request_and_respond(server.url, "--body abc", "--no-prefix", "--count 1 --config {}".format(config_file))
+        assert body == "abc of 1", body
+
+        request_and_respond(server.url, "--count 10", "", "--count 10 --config {} --batch-size 4 --batch-wait 5".format(config_file))
+        request_and_respond(server.url, "--count 10", "", "--count 10 --config {} --batch-size 4 --workers 2".format(config_file))
+
+_async_config = """
+import asyncio
+
+async def process(request, response):
+    await asyncio.sleep(0.01)
+    response.body = request.body.upper()
+"""
+
+def test_respond_async(session):
+    with TestServer() as server:
+        config_file = make_temp_file()
+        write(config_file, _async_config)
+
+        body = request_and_respond(server.url, "--body abc", "--no-prefix", "--count 1 --config {}".format(config_file))
+        assert body == "ABC", body
+
+        request_and_respond(server.url, "--count 20", "", "--count 20 --config {} --concurrency 4".format(config_file))
+
+def test_respond_reload(session):
+    with TestServer() as server:
+        config_file = make_temp_file()
+        write(config_file, "def process(request, response): response.body = 'a'\n")
+
+        respond_proc = start_qrespond(server.url, "--count 2 --reload --config {}".format(config_file))
+
+        try:
+            body = call_for_output("qrequest --no-prefix {} -m x", server.url, stdin=PIPE)
+            assert body.decode()[:-1] == "a", body
+
+            write(config_file, "def process(request, response): response.body = 'b'\n")
+            time.sleep(2)
+
+            body = call_for_output("qrequest --no-prefix {} -m x", server.url, stdin=PIPE)
+            assert body.decode()[:-1] == "b", body
+
+            check_process(respond_proc)
+        except:
+            terminate_process(respond_proc)
+            raise
+
+def test_message(session):
+    with TestServer() as server:
+        send_and_receive(server.url, "--id m1 --correlation-id c1")
+        send_and_receive(server.url, "--user ssorj")
+        send_and_receive(server.url, "--to xyz --reply-to abc")
+        send_and_receive(server.url, "--durable")
+        send_and_receive(server.url, "--priority 100")
+        send_and_receive(server.url, "--ttl 100.1")
+        send_and_receive(server.url, "--body hello")
+        send_and_receive(server.url, "--property x y --property a b")
+
+        lines = call_for_output("qmessage --count 10000 --timestamp --property x 5%").decode().splitlines()
+        assert len(lines) == 10000, len(lines)
+        assert json.loads(lines[-1])["body"] == "message-10000", lines[-1]
+
+        lines = call_for_output("qmessage --count 100 --body-size 50 --seed 7").decode().splitlines()
+        assert all(len(json.loads(x)["body"]) == 50 for x in lines), lines
+
+        for distribution in ("uniform", "normal", "lognormal"):
+            call("qmessage --count 100 --body-size 100 --body-size-distribution {}", distribution)
+
+        encoded_file = make_temp_file()
+        send_and_receive(server.url, "--count 10 --body-size 100 --body-content binary --format amqp", "--format amqp",
+                         "--count 10 --format amqp --output {}".format(encoded_file))
+
+        data = send_and_receive(server.url, "--property key '{seq % 3}' --subject 'order-{rand:uuid}' --group-id g --group-count 2",
+                                "", "--count 1 --no-prefix --json")
+        data = json.loads(data)
+        assert data["properties"] == {"key": "1"}, data
+        assert data["group_id"] == "g-1", data
+        assert len(data["subject"]) == len("order-") + 36, data
+
+        lines = call_for_output("qmessage --count 1000 --workers 3").decode().splitlines()
+        ids = set(json.loads(x)["id"] for x in lines)
+        assert len(ids) == 1000, len(ids)
+
+        output_dir = make_temp_dir()
+        call("qmessage --count 10 --workers 2 --rate 1000 --output {}/out-{{worker}}.json", output_dir)
+        assert len(read_lines(join(output_dir, "out-1.json"))) == 5
+
+        for profile in ("constant", "step", "linear", "sine"):
+            lines = call_for_output("qmessage --count 100 --rate 2000 --profile {} --period 0.02", profile).decode().splitlines()
+            assert len(lines) == 100, len(lines)
+
+        data = send_and_receive(server.url, "--user ssorj --property x y", "", "--count 1 --no-prefix --json")
+        data = json.loads(data)
+        assert data["user"] == "ssorj", data
+        assert data["properties"] == {"x": "y"}, data
+
+def test_amqp_format(session):
+    with TestServer() as server:
+        encoded_file = make_temp_file()
+
+        send_and_receive(server.url, "--body abc123 --property x y", "", "--count 1 --format amqp --output {}".format(encoded_file))
+
+        call("qsend --verbose {} --format amqp --input {}", server.url, encoded_file)
+
+        body = call_for_output("qreceive --verbose {} --count 1 --no-prefix", server.url)
+        assert body.decode()[:-1] == "abc123", body
+
+def test_latency(session):
+    with TestServer() as server:
+        latency_file = make_temp_file()
+
+        send_and_receive(server.url, "--count 10", "--timestamp", "--count 10 --latency-output {}".format(latency_file))
+        send_and_receive(server.url, "--count 10 --timestamp", "", "--count 10 --stats-interval 0.05")
+
+        output = call_for_output("qlatency --json {} {}", latency_file, latency_file)
+        summary = json.loads(output.decode())
+        assert summary["count"] == 20, summary
+
+        request_and_respond(server.url, "--count 10", "--stats-interval 0.05 --latency-output {}".format(latency_file), "--count 10")
+
+        output = call_for_output("qlatency --json {}", latency_file)
+        summary = json.loads(output.decode())
+        assert summary["count"] == 10, summary
+
+_startup_script = """
+import sys
+
+sys.path.insert(0, {python_dir!r})
+
+from qtools.{module} import {command_class}
+
+sys.argv = ["{name}", "--init-only", "q0"]
+
+command = {command_class}(None)
+command.main()
+
+# The container and optional modules must wait until the command runs
+assert command.container is None, command.container
+
+for module in ("asyncio", "concurrent.futures", "multiprocessing"):
+    assert module not in sys.modules, module
+"""
+
+def _median_time(command, *args):
+    times = list()
+
+    for i in range(5):
+        start = time.time()
+        call_for_output(command, *args)
+        times.append(time.time() - start)
+
+    return sorted(times)[len(times) // 2]
+
+def test_startup(session):
+    # Scripts run the commands many times, so startup should stay cheap
+
+    python_dir = parent_dir(parent_dir(__file__))
+    commands = (
+        ("qsend", "send", "SendCommand"),
+        ("qreceive", "receive", "ReceiveCommand"),
+        ("qrequest", "request", "RequestCommand"),
+        ("qrespond", "respond", "RespondCommand"),
+    )
+
+    for name, module, command_class in commands:
+        script = make_temp_file()
+        write(script, _startup_script.format(python_dir=python_dir, name=name,
+                                             module=module, command_class=command_class))
+
+        call("{} {}", sys.executable, script)
+
+    # Most of the remaining startup time is importing Proton
+
+    proton_time = _median_time("{} -c 'import proton.reactor, proton.handlers'", sys.executable)
+
+    for name, module, command_class in commands:
+        for args in ("--help", "--init-only q0"):
+            elapsed = _median_time("{} {}", name, args)
+            # Timing varies too much between machines to assert on
+            eprint("{} {}: {:.0f} ms ({:.0f} ms importing Proton)".format(name, args, elapsed * 1000, proton_time * 1000))
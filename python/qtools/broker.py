@@ -30,7 +30,6 @@ import proton.reactor as _reactor
 import uuid as _uuid
 
 from .common import *
-from .common import _summarize
 
 _description = "An AMQP message broker for testing"
 
@@ -45,12 +44,16 @@ class BrokerCommand(MessagingCommand):
         self.add_argument("--port", metavar="PORT", default=5672,
                           help="Listen on PORT (default 5672)")
 
+        self.add_transport_arguments()
+
     def init(self):
         super(BrokerCommand, self).init()
 
         self.host = self.args.host
         self.port = self.args.port
 
+        self.init_transport_attributes()
+
 class _Queue(object):
     def __init__(self, command, address):
         self.command = command
@@ -85,7 +88,8 @@ class _Queue(object):
     def store_message(self, delivery, message):
         self.messages.append(message)
 
-        self.command.notice("Stored {} from {} on {}", message, delivery.connection, self)
+        if not self.command.quiet:
+            self.command.notice("Stored {} from {} on {}", message, delivery.connection, self)
 
     def forward_messages(self, link):
         assert link.is_sender
@@ -98,7 +102,8 @@ class _Queue(object):
 
             link.send(message)
 
-            self.command.notice("Forwarded {} on {} to {}", message, self, link.connection)
+            if not self.command.quiet:
+                self.command.notice("Forwarded {} on {} to {}", message, self, link.connection)
 
 class _Handler(_handlers.MessagingHandler):
     def __init__(self, command):
@@ -150,9 +155,18 @@ class _Handler(_handlers.MessagingHandler):
         # XXX I think this should happen automatically
         event.connection.container = event.container.container_id
 
+    def on_connection_bound(self, event):
+        self.command.configure_transport(event.transport)
+
+    def on_session_opening(self, event):
+        self.command.configure_session(event.session)
+
     def on_connection_opened(self, event):
         self.command.notice("Opened connection from {}", event.connection)
 
+        if self.command.verbose:
+            log_transport(self.command, event.connection)
+
     def on_connection_closing(self, event):
         self.remove_consumers(event.connection)
 
@@ -179,21 +193,7 @@ class _Handler(_handlers.MessagingHandler):
         queue.forward_messages(event.link)
 
     def on_settled(self, event):
-        delivery = event.delivery
-
-        template = "{} {{}} {} to {}"
-        template = template.format(_summarize(event.connection),
-                                   _summarize(delivery),
-                                   _summarize(event.link.source))
-
-        if delivery.remote_state == delivery.ACCEPTED:
-            self.command.info(template, "accepted")
-        elif delivery.remote_state == delivery.REJECTED:
-            self.command.warn(template, "rejected")
-        elif delivery.remote_state == delivery.RELEASED:
-            self.command.notice(template, "released")
-        elif delivery.remote_state == delivery.MODIFIED:
-            self.command.notice(template, "modified")
+        log_settled_delivery(self.command, event, event.link.source)
 
     def on_message(self, event):
         message = event.message
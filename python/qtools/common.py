@@ -24,19 +24,31 @@ from __future__ import unicode_literals
 from __future__ import with_statement
 
 import argparse as _argparse
+import base64 as _base64
 import binascii as _binascii
 import collections as _collections
 import commandant as _commandant
+import importlib as _importlib
 import json as _json
+import math as _math
+import operator as _operator
 import os as _os
 import proton as _proton
 import proton.handlers as _handlers
 import proton.reactor as _reactor
+import random as _random
+import socket as _socket
+import struct as _struct
 import sys as _sys
 import time as _time
 import threading as _threading
 import uuid as _uuid
 
+try:
+    import orjson as _orjson
+except ImportError:
+    _orjson = None
+
 try:
     from urllib.parse import urlparse as _urlparse
 except ImportError:
@@ -55,29 +67,83 @@ class MessagingCommand(_commandant.Command):
     def __init__(self, home, name, handler):
         super(MessagingCommand, self).__init__(home, name)
 
-        self.container = _reactor.Container(handler)
+        # The event injector, threads, and codec are created in init(),
+        # after argument parsing, so --help skips them.  The container
+        # is created in run(), so --init-only skips it too.
 
-        self.events = _reactor.EventInjector()
-        self.container.selectable(self.events)
+        self.handler = handler
+        self.container = None
+        self.events = None
 
         self.input_file = _sys.stdin
-        self.input_thread = _InputThread(self)
+        self.input_format = "text"
+        self.input_thread = None
 
         self.output_file = _sys.stdout
-        self.output_thread = _OutputThread(self)
+        self.output_format = "text"
+        self.output_thread = None
+
+        self.codec = None
+        self.log = _LogSink()
+        self.stats = MessagingStats()
 
         self.ready = _threading.Event()
 
+        self.rate = None
+
         self.add_argument("--id", metavar="ID",
                           help="Set the container identity to ID")
+        self.add_argument("--log-format", metavar="FORMAT", choices=("text", "json"), default="text",
+                          help="Write log records in FORMAT: text or json (default text)")
 
     def add_link_arguments(self):
         self.add_argument("url", metavar="ADDRESS-URL", nargs="+",
                           help="The location of a message source or target")
-        self.add_argument("--server", metavar="HOST[:PORT]", default="127.0.0.1:5672",
-                          help="Use HOST[:PORT] as the default server (default 127.0.0.1:5672)")
+        self.add_argument("--server", metavar="HOST[:PORT]", action="append",
+                          help="Use HOST[:PORT] as the default server (default 127.0.0.1:5672).  "
+                          "Repeat to add failover servers for connections to the first one.")
         self.add_argument("--tls", action="store_true",
                           help="Connect using SSL/TLS authentication and encryption")
+        self.add_argument("--links-per-connection", metavar="COUNT", type=int,
+                          help="Open at most COUNT links on each connection.  "
+                          "Addresses on the same server share connections up to this limit (default no limit).")
+        self.add_argument("--reconnect-attempts", metavar="COUNT", type=int,
+                          help="Give up after COUNT attempts to reconnect to each server (default no limit).  "
+                          "Use 0 to disable reconnecting.")
+        self.add_argument("--reconnect-delay", metavar="SECONDS", type=float, default=0.1,
+                          help="Wait SECONDS before the second reconnect attempt, doubling each time after (default 0.1)")
+        self.add_argument("--reconnect-max-delay", metavar="SECONDS", type=float, default=10,
+                          help="Wait at most SECONDS between reconnect attempts (default 10)")
+        self.add_argument("--stats-interval", metavar="SECONDS", type=float,
+                          help="Report throughput and latency every SECONDS")
+        self.add_argument("--stats-output", metavar="FILE",
+                          help="Write stats to FILE as JSON lines (default console text)")
+
+        self.add_transport_arguments()
+
+    def add_transport_arguments(self):
+        self.add_argument("--max-frame-size", metavar="BYTES", type=int,
+                          help="Accept AMQP frames of up to BYTES (default set by Proton)")
+        self.add_argument("--session-window", metavar="BYTES", type=int,
+                          help="Buffer up to BYTES of incoming transfers on each session.  "
+                          "This sets the session's incoming window.  It must hold the largest message.")
+        self.add_argument("--idle-timeout", metavar="SECONDS", type=float,
+                          help="Close connections that are silent for SECONDS.  "
+                          "Peers send heartbeats at half this interval.")
+        self.add_argument("--socket-send-buffer", metavar="BYTES", type=int,
+                          help="Set the TCP send buffer size to BYTES")
+        self.add_argument("--socket-receive-buffer", metavar="BYTES", type=int,
+                          help="Set the TCP receive buffer size to BYTES")
+
+    def add_rate_arguments(self):
+        self.add_argument("--rate", metavar="COUNT", type=float,
+                          help="Send COUNT messages per second on a fixed schedule.  "
+                          "Latency is measured from each message's scheduled send time.")
+
+    def add_latency_arguments(self, description):
+        self.add_argument("--latency-output", metavar="FILE",
+                          help="Write the {} latency histogram to FILE on exit.  "
+                          "Use qlatency to combine the results of several runs.".format(description))
 
     def init(self):
         super(MessagingCommand, self).init()
@@ -87,12 +153,117 @@ class MessagingCommand(_commandant.Command):
         if self.id is None:
             self.id = "{}-{}".format(self.name, unique_id())
 
-        self.container.container_id = self.id
+        self.log.source = self.id
+        self.log.json_enabled = self.args.log_format == "json"
+
+        self.codec = MessageCodec()
+
+        self.events = _reactor.EventInjector()
+        self.input_thread = _InputThread(self)
+        self.output_thread = _OutputThread(self)
 
     def init_link_attributes(self):
-        self.server = self.args.server
+        self.servers = self.args.server
+
+        if self.servers is None:
+            self.servers = ["127.0.0.1:5672"]
+
+        self.server = self.servers[0]
         self.tls_enabled = self.args.tls
         self.urls = self.args.url
+        self.links_per_connection = self.args.links_per_connection
+
+        if self.links_per_connection is not None and self.links_per_connection < 1:
+            self.fail("The links per connection must be at least 1")
+
+        self.reconnect_attempts = self.args.reconnect_attempts
+        self.reconnect_delay = self.args.reconnect_delay
+        self.reconnect_max_delay = self.args.reconnect_max_delay
+
+        if self.reconnect_attempts is not None and self.reconnect_attempts < 0:
+            self.fail("The reconnect attempts cannot be negative")
+
+        if self.reconnect_delay <= 0 or self.reconnect_max_delay <= 0:
+            self.fail("The reconnect delays must be greater than zero")
+
+        self.reconnect_enabled = self.reconnect_attempts != 0
+
+        self.init_transport_attributes()
+
+        self.stats_interval = self.args.stats_interval
+        self.stats_file = None
+
+        if self.stats_interval is not None:
+            if self.stats_interval <= 0:
+                self.fail("The stats interval must be greater than zero")
+
+            self.stats.timestamps_enabled = True
+
+            if self.args.stats_output is not None:
+                self.stats_file = open(self.args.stats_output, "w")
+
+    def init_transport_attributes(self):
+        self.max_frame_size = self.args.max_frame_size
+        self.session_window = self.args.session_window
+        self.idle_timeout = self.args.idle_timeout
+
+        # AMQP requires frames of at least 512 bytes
+        if self.max_frame_size is not None and self.max_frame_size < 512:
+            self.fail("The max frame size must be at least 512 bytes")
+
+        if self.session_window is not None and self.session_window < 1:
+            self.fail("The session window must be at least 1 byte")
+
+        if self.idle_timeout is not None and self.idle_timeout <= 0:
+            self.fail("The idle timeout must be greater than zero")
+
+        send_size = self.args.socket_send_buffer
+        receive_size = self.args.socket_receive_buffer
+
+        for size in (send_size, receive_size):
+            if size is not None and size < 1:
+                self.fail("Socket buffer sizes must be at least 1 byte")
+
+        if send_size is not None or receive_size is not None:
+            _set_socket_buffer_sizes(self, send_size, receive_size)
+
+    def configure_transport(self, transport):
+        # For connections accepted by qbroker.  Outgoing connections
+        # take the same settings as connect options.
+
+        if self.max_frame_size is not None:
+            transport.max_frame_size = self.max_frame_size
+
+        if self.idle_timeout is not None:
+            transport.idle_timeout = self.idle_timeout
+
+    def configure_session(self, session):
+        if self.session_window is not None:
+            session.incoming_capacity = self.session_window
+
+    def init_rate_attributes(self):
+        self.rate = self.args.rate
+
+        if self.rate is not None and self.rate <= 0:
+            self.fail("The rate must be greater than zero")
+
+    def init_latency_attributes(self):
+        self.latency_file = None
+
+        if self.args.latency_output is not None:
+            self.latency_file = open(self.args.latency_output, "w")
+
+    def report_latency(self, description):
+        latency = self.stats.get_total_latency()
+
+        if latency.count:
+            self.notice("{} latency {}", description, format_latency(latency.summary()))
+
+        if self.latency_file is not None:
+            with self.latency_file as f:
+                _json.dump(latency.to_data(), f)
+
+            self.latency_file = None
 
     def parse_address_url(self, address):
         url = _urlparse(address)
@@ -106,11 +277,7 @@ class MessagingCommand(_commandant.Command):
         path = url.path
 
         default_scheme = "amqps" if self.tls_enabled else "amqp"
-
-        try:
-            default_host, default_port = self.server.split(":", 1)
-        except ValueError:
-            default_host, default_port = self.server, 5672
+        default_host, default_port = _split_server(self.server)
 
         if not scheme:
             scheme = default_scheme
@@ -128,12 +295,60 @@ class MessagingCommand(_commandant.Command):
 
         return scheme, host, port, path
 
+    def failover_urls(self, scheme, host, port):
+        # Connections to the first server fail over to the others
+
+        if (host, port) != _split_server(self.server):
+            return []
+
+        return ["{}://{}:{}".format(scheme, *_split_server(x)) for x in self.servers[1:]]
+
+    def init_container(self):
+        # Creating a container sets up its SSL domains, which is the
+        # slowest part of startup
+
+        self.container = _reactor.Container(self.handler)
+        self.container.container_id = self.id
+        self.container.selectable(self.events)
+
     def run(self):
-        self.container.run()
+        self.init_container()
+
+        try:
+            self.container.run()
+        finally:
+            self.log.flush()
+
+    # Info lines are buffered.  Hot paths should check self.verbose
+    # before calling info() so that disabled logging costs nothing.
+
+    def info(self, message, *args):
+        if self.verbose:
+            self.log.write("info", self.format_message(message, args))
+
+    def notice(self, message, *args):
+        if not self.quiet:
+            self.log_message("notice", message, args)
+
+    def warn(self, message, *args):
+        self.log_message("warning", message, args)
+
+    def error(self, message, *args):
+        self.log_message("error", message, args)
 
     def print_message(self, message, *args):
-        summarized_args = [_summarize(x) for x in args]
-        super(MessagingCommand, self).print_message(message, *summarized_args)
+        self.log_message("notice", message, args)
+
+    def log_message(self, level, message, args):
+        self.log.write(level, self.format_message(message, args))
+        self.log.flush()
+
+    def format_message(self, message, args):
+        args = [_summarize(x) for x in args]
+
+        message = message[0].upper() + message[1:]
+
+        return message.format(*args)
 
 class LinkHandler(_handlers.MessagingHandler):
     def __init__(self, command, **kwargs):
@@ -143,41 +358,181 @@ class LinkHandler(_handlers.MessagingHandler):
 
         self.connections = list()
         self.links = list()
+        self.senders = _collections.deque()
 
         self.opened_links = 0
 
         self.done_sending = False
         self.done_receiving = False
 
+        self.timers = list()
+
+        self.schedule = None
+
+        # Reconnect state for each connection
+        self.backoffs = dict()
+        self.opened_connections = set()
+        self.disconnected_connections = set()
+
+        # Sent deliveries the peer hasn't settled, with what is needed
+        # to send them again if the connection drops, those waiting to
+        # be sent again, and links waiting to be reattached
+        self.unsettled = _collections.OrderedDict()
+        self.resends = _collections.deque()
+        self.detached_links = set()
+
     def on_start(self, event):
+        if self.command.verbose:
+            self.start_timer(event, self.command.log.interval, self.flush_log)
+
+        if self.command.stats_interval is not None:
+            self.command.stats.start()
+            self.start_timer(event, self.command.stats_interval, self.report_stats)
+
+        # Addresses on the same server share a connection until it
+        # has --links-per-connection links.  The pool maps each
+        # connection URL to its newest connection and link count.
+
+        limit = self.command.links_per_connection
+        pool = dict()
+
         for url in self.command.urls:
             scheme, host, port, address = self.command.parse_address_url(url)
             connection_url = "{}://{}:{}".format(scheme, host, port)
 
-            self.command.info("Connecting to {}", connection_url)
-
-            allowed_mechs = "ANONYMOUS"
+            connection, link_count = pool.get(connection_url, (None, 0))
 
-            if _sys.version_info.major == 2:
-                allowed_mechs = b"ANONYMOUS"
+            if connection is None or (limit is not None and link_count >= limit):
+                failover_urls = self.command.failover_urls(scheme, host, port)
+                connection = self.connect(event, [connection_url] + failover_urls)
+                link_count = 0
 
-            connection = event.container.connect(connection_url, allowed_mechs=allowed_mechs)
             links = self.open_links(event, connection, address)
 
-            self.connections.append(connection)
+            pool[connection_url] = connection, link_count + len(links)
+
             self.links.extend(links)
 
+    def connect(self, event, connection_urls):
+        self.command.info("Connecting to {}", ", ".join(connection_urls))
+
+        allowed_mechs = "ANONYMOUS"
+
+        if _sys.version_info.major == 2:
+            allowed_mechs = b"ANONYMOUS"
+
+        options = {"allowed_mechs": allowed_mechs}
+
+        if self.command.max_frame_size is not None:
+            options["max_frame_size"] = self.command.max_frame_size
+
+        if self.command.idle_timeout is not None:
+            options["heartbeat"] = self.command.idle_timeout
+
+        if self.command.reconnect_enabled:
+            def give_up():
+                self.command.fail("Failed to reconnect to {}", ", ".join(connection_urls))
+
+            backoff = ReconnectBackoff(self.command.reconnect_attempts,
+                                       self.command.reconnect_delay,
+                                       self.command.reconnect_max_delay,
+                                       give_up)
+        else:
+            backoff = False
+
+        connection = event.container.connect(urls=connection_urls, reconnect=backoff, **options)
+
+        if self.command.session_window is not None:
+            connection._session_policy = _SessionPolicy(self.command)
+
+        self.connections.append(connection)
+        self.backoffs[connection] = backoff
+
+        return connection
+
     def open_links(self, connection):
         raise NotImplementedError()
 
     def on_connection_opened(self, event):
-        assert event.connection in self.connections
+        connection = event.connection
+
+        assert connection in self.connections
+
+        if connection in self.opened_connections:
+            self.command.notice("Reconnected to {}", connection)
+            self.disconnected_connections.discard(connection)
+        else:
+            self.command.info("Connected to {}", connection)
+            self.opened_connections.add(connection)
+
+        if self.command.verbose:
+            log_transport(self.command, connection)
+
+    def on_disconnected(self, event):
+        connection = event.connection
+
+        if connection.state & _proton.Endpoint.LOCAL_CLOSED:
+            return
 
-        self.command.info("Connected to {}", event.connection)
+        if self.backoffs[connection] is False:
+            self.command.fail("Disconnected from {}", connection.url)
+
+        # Proton reports each failed attempt, sometimes twice
+
+        if connection in self.disconnected_connections:
+            return
+
+        self.disconnected_connections.add(connection)
+
+        if connection not in self.opened_connections:
+            self.command.info("Failed to connect to {}; retrying", connection.url)
+            return
+
+        # Proton reattaches the links when it reconnects.  Until then
+        # they send nothing.
+
+        for link in self.links:
+            if link.connection == connection:
+                self.detached_links.add(link)
+
+        self.command.notice("Disconnected from {}; reconnecting", connection.url)
+
+        count = self.queue_resends(connection)
+
+        if count:
+            self.command.notice("Resending {} {} after reconnecting",
+                                count, plural("message", count))
+
+    def queue_resends(self, connection):
+        # Deliveries the peer hadn't settled may never have arrived,
+        # so their messages are sent again on the reattached links.
+        # Proton doesn't resend the old deliveries itself, and
+        # settling them here would make it send empty transfers, so
+        # they are left alone.  Returns the number queued.
+
+        count = 0
+
+        for delivery, (data, send_time) in list(self.unsettled.items()):
+            if delivery.link.connection != connection:
+                continue
+
+            del self.unsettled[delivery]
+            self.resends.append((delivery.link, data, send_time))
+            count += 1
+
+        return count
 
     def on_link_opened(self, event):
         assert event.link in self.links
 
+        if event.link in self.detached_links:
+            self.detached_links.discard(event.link)
+
+            self.command.info("Reattached link '{}' on {}", event.link.name, event.connection)
+            self.send_messages(event)
+
+            return
+
         self.opened_links += 1
 
         if event.link.is_receiver:
@@ -193,29 +548,685 @@ class LinkHandler(_handlers.MessagingHandler):
         if self.opened_links == len(self.links):
             self.command.ready.set()
 
-    def on_settled(self, event):
-        delivery = event.delivery
+            if self.command.rate is not None:
+                self.schedule = SendSchedule(self.command.rate)
+                self.schedule.start()
+
+                # Poll the schedule so due messages go out even when
+                # no other event arrives
+                interval = min(self.schedule.interval, 0.01)
+                self.start_timer(event, interval, self.send_messages)
+
+            self.send_messages(event)
+
+    def send_messages(self, event):
+        if self.resends:
+            self.resend_messages()
+
+        # Go round the senders until none of them can send
 
-        template = "{} {{}} {} to {}"
-        template = template.format(_summarize(event.connection),
-                                   _summarize(delivery),
-                                   _summarize(event.link.target))
+        idle = 0
 
-        if delivery.remote_state == delivery.ACCEPTED:
-            self.command.info(template, "accepted")
-        elif delivery.remote_state == delivery.REJECTED:
-            self.command.warn(template, "rejected")
-        elif delivery.remote_state == delivery.RELEASED:
-            self.command.notice(template, "released")
-        elif delivery.remote_state == delivery.MODIFIED:
-            self.command.notice(template, "modified")
+        while idle < len(self.senders):
+            sender = self.senders.pop()
+            self.senders.appendleft(sender)
+
+            if sender not in self.detached_links and self.send_message(event, sender):
+                idle = 0
+            else:
+                idle += 1
+
+    def send_message(self, event, sender):
+        # Return True if a message was sent
+        return False
+
+    def resend_messages(self):
+        # Resend in the original order, stopping at the first sender
+        # without credit
+
+        while self.resends:
+            sender, data, send_time = self.resends[0]
+
+            if sender in self.detached_links or not sender.credit:
+                break
+
+            self.resends.popleft()
+            self.resend_message(sender, data, send_time)
+
+    def resend_message(self, sender, data, send_time):
+        delivery = self.transfer(sender, data, send_time)
+
+        if self.command.verbose:
+            self.command.info("Resent {} to {} on {}", delivery, sender.target, sender.connection)
+
+    def message_due(self):
+        return self.schedule is None or self.schedule.next_time() <= _time.time()
+
+    def on_settled(self, event):
+        self.unsettled.pop(event.delivery, None)
+        self.command.stats.record_settled(event.delivery)
+
+        log_settled_delivery(self.command, event, event.link.target)
 
     def close(self, event):
         for connection in self.connections:
             connection.close()
 
+        for timer in self.timers:
+            timer.stop()
+
+        if self.command.stats_interval is not None:
+            self.report_stats()
+
         self.command.events.close()
 
+    def start_timer(self, event, interval, function):
+        timer = PeriodicTimer(interval, function)
+        timer.start(event.container)
+
+        self.timers.append(timer)
+
+        return timer
+
+    def transfer(self, sender, message, send_time=None):
+        if isinstance(message, _proton.Message):
+            data = message.encode()
+        else:
+            data = message
+
+        delivery = send_encoded_message(sender, data)
+
+        self.command.stats.record_sent(delivery, len(data), send_time)
+
+        if self.command.reconnect_enabled and not delivery.settled:
+            self.unsettled[delivery] = data, send_time
+
+        return delivery
+
+    def on_delivery(self, event):
+        delivery = event.delivery
+
+        if delivery.readable and not delivery.partial:
+            self.command.stats.record_received(delivery.pending)
+
+    def flush_log(self, event):
+        self.command.log.flush()
+
+    def stats_counters(self):
+        # Command-specific counters to include in stats reports
+        return None
+
+    def report_stats(self, event=None):
+        credit = sum(link.credit for link in self.links)
+        snapshot = self.command.stats.snapshot(credit)
+        counters = self.stats_counters()
+
+        if counters:
+            snapshot["counters"] = counters
+
+        if self.command.stats_file is None:
+            self.command.print_message(format_stats(snapshot))
+            return
+
+        self.command.stats_file.write(_json.dumps(snapshot) + "\n")
+        self.command.stats_file.flush()
+
+SEND_TIME_ANNOTATION = _proton.symbol("x-opt-qtools-send-time")
+
+def stamp_send_time(message, send_time=None):
+    # Proton copies the annotations on assignment, so assign after
+    # updating
+
+    if send_time is None:
+        send_time = _time.time()
+
+    annotations = message.annotations
+
+    if annotations is None:
+        annotations = dict()
+
+    annotations[SEND_TIME_ANNOTATION] = send_time
+
+    message.annotations = annotations
+
+def log_transport(command, connection):
+    transport = connection.transport
+
+    command.info("Negotiated transport on {}: max frame size {} local, {} remote; "
+                 "idle timeout {} local, {} remote; channel max {} local, {} remote",
+                 connection,
+                 transport.max_frame_size,
+                 transport.remote_max_frame_size,
+                 transport.idle_timeout,
+                 transport.remote_idle_timeout,
+                 transport.channel_max,
+                 transport.remote_channel_max)
+
+class _SessionPolicy(object):
+    # Proton opens one session per connection when the first link is
+    # created.  This policy does the same, but applies the session
+    # window before the session opens.
+
+    def __init__(self, command):
+        self.command = command
+        self.default_session = None
+
+    def session(self, connection):
+        if self.default_session is None:
+            self.default_session = connection.session()
+            self.command.configure_session(self.default_session)
+            self.default_session.open()
+
+        return self.default_session
+
+def _set_socket_buffer_sizes(command, send_size, receive_size):
+    # Proton creates its sockets internally, so wrap the function it
+    # calls to set up each new socket.  It runs before connecting and
+    # after accepting, so the sizes apply to TCP window negotiation.
+
+    try:
+        import proton._io as _io
+        setup = _io.IO._setupsocket
+    except (ImportError, AttributeError):
+        command.warn("This version of Proton does not support setting socket buffer sizes")
+        return
+
+    def setupsocket(sock):
+        setup(sock)
+
+        if send_size is not None:
+            sock.setsockopt(_socket.SOL_SOCKET, _socket.SO_SNDBUF, send_size)
+
+        if receive_size is not None:
+            sock.setsockopt(_socket.SOL_SOCKET, _socket.SO_RCVBUF, receive_size)
+
+        if command.verbose:
+            command.info("Set socket buffers to {} bytes send, {} bytes receive",
+                         sock.getsockopt(_socket.SOL_SOCKET, _socket.SO_SNDBUF),
+                         sock.getsockopt(_socket.SOL_SOCKET, _socket.SO_RCVBUF))
+
+    _io.IO._setupsocket = staticmethod(setupsocket)
+
+def log_settled_delivery(command, event, terminus):
+    delivery = event.delivery
+    state = delivery.remote_state
+
+    if state == delivery.ACCEPTED:
+        if command.verbose:
+            command.info(_settled_template(event, terminus), "accepted")
+    elif state == delivery.REJECTED:
+        command.warn(_settled_template(event, terminus), "rejected")
+    elif not command.quiet:
+        if state == delivery.RELEASED:
+            command.notice(_settled_template(event, terminus), "released")
+        elif state == delivery.MODIFIED:
+            command.notice(_settled_template(event, terminus), "modified")
+
+def _settled_template(event, terminus):
+    template = "{} {{}} {} to {}"
+    template = template.format(_summarize(event.connection),
+                               _summarize(event.delivery),
+                               _summarize(terminus))
+
+    return template
+
+class _LogSink(object):
+    # Collects log records and writes them to stderr in batches.
+    # Records are (time, level, message) and are rendered as text or
+    # JSON lines only when written.
+
+    def __init__(self, capacity=256, interval=0.25):
+        self.capacity = capacity
+        self.interval = interval
+
+        self.source = None
+        self.json_enabled = False
+
+        self.records = list()
+        self.flush_time = _time.time()
+
+    def write(self, level, message):
+        now = _time.time()
+        self.records.append((now, level, message))
+
+        if len(self.records) >= self.capacity or now - self.flush_time >= self.interval:
+            self.flush()
+
+    def flush(self):
+        records, self.records = self.records, list()
+
+        if records:
+            render = self.render_json if self.json_enabled else self.render_text
+            _sys.stderr.write("".join([render(x) for x in records]))
+
+        _sys.stderr.flush()
+
+        self.flush_time = _time.time()
+
+    def render_text(self, record):
+        time, level, message = record
+        return "{}: {}{}\n".format(self.source, _log_prefixes.get(level, ""), message)
+
+    def render_json(self, record):
+        time, level, message = record
+
+        data = _collections.OrderedDict()
+        data["time"] = time
+        data["source"] = self.source
+        data["level"] = level
+        data["message"] = message
+
+        return _json_dumps(data) + "\n"
+
+_log_prefixes = {
+    "warning": "Warning! ",
+    "error": "Error! ",
+}
+
+class PeriodicTimer(object):
+    def __init__(self, interval, function):
+        self.interval = interval
+        self.function = function
+        self.task = None
+        self.stopped = True
+
+    def start(self, container):
+        self.stopped = False
+        self.task = container.schedule(self.interval, self)
+
+    def stop(self):
+        self.stopped = True
+
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    def on_timer_task(self, event):
+        self.task = None
+        self.function(event)
+
+        # The function may have stopped the timer
+        if not self.stopped:
+            self.task = event.container.schedule(self.interval, self)
+
+class ReconnectBackoff(object):
+    """
+    Reconnect delays for Proton, which tries every server after each
+    delay and starts over once connected.  The first attempt is
+    immediate.  After that the delay doubles up to the maximum, with
+    random jitter so that many clients don't reconnect in step.
+    give_up() is called when the attempts run out.
+
+    Newer Proton iterates the object.  Older Proton calls reset() and
+    next(), which Proton 0.40 also accepts.
+    """
+
+    def __init__(self, attempts, delay, max_delay, give_up):
+        self.attempts = attempts
+        self.delay = delay
+        self.max_delay = max_delay
+        self.give_up = give_up
+
+        self.delays = None
+        self.reset()
+
+    def reset(self):
+        self.delays = iter(self)
+
+    def next(self):
+        return next(self.delays)
+
+    def __iter__(self):
+        yield 0
+
+        delay = self.delay
+        count = 1
+
+        while self.attempts is None or count < self.attempts:
+            # Somewhere between half the delay and the whole of it
+            yield delay * (0.5 + _random.random() / 2)
+
+            delay = min(delay * 2, self.max_delay)
+            count += 1
+
+        self.give_up()
+
+class SendSchedule(object):
+    """
+    An open-loop send schedule.  Message k, counting from zero, is due
+    at the start time plus k / rate, whether or not the messages
+    before it went out on time.  Measuring latency from the scheduled
+    time keeps stalls from hiding queueing delay (coordinated
+    omission).
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.start_time = None
+        self.count = 0
+
+    def start(self):
+        self.start_time = _time.time()
+
+    def next_time(self):
+        return self.start_time + self.count * self.interval
+
+    def advance(self):
+        """Take the next slot and return its scheduled time"""
+
+        send_time = self.next_time()
+        self.count += 1
+
+        return send_time
+
+class TimerWheel(object):
+    """
+    Tracks deadlines in a ring of time slots.  Adding an item costs
+    O(1), and expire() visits only the slots whose time has come.
+    Deadlines further out than one turn of the wheel stay in their
+    slot until a later turn.
+    """
+
+    def __init__(self, resolution, size=512):
+        self.resolution = resolution
+        self.slots = [list() for i in range(size)]
+        self.current = int(_time.time() / resolution)
+
+    def add(self, deadline, item):
+        tick = max(int(deadline / self.resolution), self.current)
+        self.slots[tick % len(self.slots)].append((deadline, item))
+
+    def expire(self, now):
+        """Remove and return the items whose deadlines have passed"""
+
+        expired = list()
+        end = int(now / self.resolution)
+        size = len(self.slots)
+
+        for tick in range(self.current, self.current + min(end - self.current + 1, size)):
+            slot = self.slots[tick % size]
+
+            if not slot:
+                continue
+
+            pending = list()
+
+            for entry in slot:
+                if entry[0] <= now:
+                    expired.append(entry[1])
+                else:
+                    pending.append(entry)
+
+            slot[:] = pending
+
+        self.current = end
+
+        return expired
+
+class MessagingStats(object):
+    # Counters are plain attribute increments.  The per-delivery send
+    # time is recorded only when timestamps are enabled.
+
+    def __init__(self):
+        self.timestamps_enabled = False
+
+        self.sent_messages = 0
+        self.sent_bytes = 0
+        self.received_messages = 0
+        self.received_bytes = 0
+        self.settled_messages = 0
+
+        self.settle_latency = LatencyHistogram()
+
+        # End-to-end latency from the send-time annotation.  The
+        # current interval is folded into the total at each snapshot.
+        self.latency = LatencyHistogram()
+        self.total_latency = LatencyHistogram()
+
+        self.start_time = None
+        self.previous = None
+
+    def start(self):
+        self.start_time = _time.time()
+        self.previous = self._counters(self.start_time)
+
+    def record_sent(self, delivery, size, send_time=None):
+        self.sent_messages += 1
+        self.sent_bytes += size
+
+        if delivery.settled:
+            self.settled_messages += 1
+        elif self.timestamps_enabled:
+            if send_time is None:
+                send_time = _time.time()
+
+            delivery.send_time = send_time
+
+    def record_received(self, size):
+        self.received_messages += 1
+        self.received_bytes += size
+
+    def record_settled(self, delivery):
+        self.settled_messages += 1
+
+        if self.timestamps_enabled:
+            try:
+                send_time = delivery.send_time
+            except AttributeError:
+                return
+
+            self.settle_latency.record(_time.time() - send_time)
+
+    def record_latency(self, message):
+        annotations = message.annotations
+
+        if annotations is None:
+            return
+
+        try:
+            send_time = annotations[SEND_TIME_ANNOTATION]
+        except KeyError:
+            return
+
+        self.latency.record(_time.time() - send_time)
+
+    def get_total_latency(self):
+        total = LatencyHistogram()
+        total.merge(self.total_latency)
+        total.merge(self.latency)
+
+        return total
+
+    def snapshot(self, credit):
+        now = _time.time()
+        current = self._counters(now)
+        previous, self.previous = self.previous, current
+
+        elapsed = max(now - previous[0], 1e-9)
+        rates = [(c - p) / elapsed for c, p in zip(current[1:], previous[1:])]
+
+        settle_latency, self.settle_latency = self.settle_latency, LatencyHistogram()
+        latency, self.latency = self.latency, LatencyHistogram()
+
+        self.total_latency.merge(latency)
+
+        snapshot = _collections.OrderedDict()
+        snapshot["timestamp"] = round(now, 3)
+        snapshot["elapsed"] = round(now - self.start_time, 3)
+        snapshot["sent_messages"] = self.sent_messages
+        snapshot["received_messages"] = self.received_messages
+        snapshot["sent_messages_per_second"] = round(rates[0], 1)
+        snapshot["sent_bytes_per_second"] = round(rates[1], 1)
+        snapshot["received_messages_per_second"] = round(rates[2], 1)
+        snapshot["received_bytes_per_second"] = round(rates[3], 1)
+        snapshot["in_flight"] = self.sent_messages - self.settled_messages
+        snapshot["credit"] = credit
+        snapshot["settle_latency"] = settle_latency.summary()
+        snapshot["latency"] = latency.summary()
+
+        return snapshot
+
+    def _counters(self, now):
+        return (now, self.sent_messages, self.sent_bytes,
+                self.received_messages, self.received_bytes)
+
+def format_stats(snapshot):
+    settle_latency = snapshot["settle_latency"]
+    latency = snapshot["latency"]
+
+    out = [
+        "Stats: sent {:,.0f}/s ({}/s)".format(snapshot["sent_messages_per_second"],
+                                               format_bytes(snapshot["sent_bytes_per_second"])),
+        "received {:,.0f}/s ({}/s)".format(snapshot["received_messages_per_second"],
+                                           format_bytes(snapshot["received_bytes_per_second"])),
+        "in flight {}".format(snapshot["in_flight"]),
+        "credit {}".format(snapshot["credit"]),
+    ]
+
+    if settle_latency["count"]:
+        out.append("settle latency p50 {p50} ms, p99 {p99} ms, max {max} ms".format(**settle_latency))
+
+    if latency["count"]:
+        out.append("latency {}".format(format_latency(latency)))
+
+    for name, value in snapshot.get("counters", dict()).items():
+        out.append("{} {}".format(name.replace("_", " "), value))
+
+    return ", ".join(out)
+
+def format_latency(summary):
+    return "p50 {p50} ms, p99 {p99} ms, p999 {p999} ms, max {max} ms".format(**summary)
+
+def format_bytes(count):
+    for unit in ("B", "KB", "MB"):
+        if count < 1000:
+            return "{:.1f} {}".format(count, unit)
+
+        count /= 1000
+
+    return "{:.1f} GB".format(count)
+
+class LatencyHistogram(object):
+    """
+    A log-bucketed histogram of latencies, in the manner of HDR
+    histograms.  Values are recorded in microseconds.  Each power of
+    two is split into 64 buckets, so reported values are within about
+    1.5% of the recorded ones.  Recording costs O(1).
+
+    Histograms with the same layout can be merged, including ones
+    saved by other processes with to_data().
+    """
+
+    precision_bits = 7
+    max_bits = 40
+
+    def __init__(self):
+        half = 1 << (self.precision_bits - 1)
+        size = ((self.max_bits - self.precision_bits + 2) * half)
+
+        self.counts = [0] * size
+        self.count = 0
+        self.max = 0
+
+    def record(self, seconds):
+        value = int(seconds * 1000000)
+
+        if value < 0:
+            value = 0
+
+        self.counts[self._index(value)] += 1
+        self.count += 1
+
+        if value > self.max:
+            self.max = value
+
+    def _index(self, value):
+        shift = value.bit_length() - self.precision_bits
+
+        if shift <= 0:
+            return value
+
+        if shift > self.max_bits - self.precision_bits:
+            return len(self.counts) - 1
+
+        return (shift << (self.precision_bits - 1)) + (value >> shift)
+
+    def _value(self, index):
+        if index < (1 << self.precision_bits):
+            return index
+
+        shift = (index >> (self.precision_bits - 1)) - 1
+        mantissa = index - (shift << (self.precision_bits - 1))
+
+        # The middle of the bucket
+        return (mantissa << shift) + ((1 << shift) >> 1)
+
+    def merge(self, other):
+        if len(other.counts) != len(self.counts):
+            raise ValueError("Histogram layouts differ")
+
+        counts = self.counts
+
+        for index, count in enumerate(other.counts):
+            if count:
+                counts[index] += count
+
+        self.count += other.count
+        self.max = max(self.max, other.max)
+
+    def to_data(self):
+        data = _collections.OrderedDict()
+        data["precision_bits"] = self.precision_bits
+        data["max_bits"] = self.max_bits
+        data["count"] = self.count
+        data["max"] = self.max
+        data["counts"] = dict((str(i), c) for i, c in enumerate(self.counts) if c)
+
+        return data
+
+    @classmethod
+    def from_data(cls, data):
+        histogram = cls()
+
+        if (data["precision_bits"], data["max_bits"]) != (cls.precision_bits, cls.max_bits):
+            raise ValueError("Histogram layouts differ")
+
+        for index, count in data["counts"].items():
+            histogram.counts[int(index)] = count
+
+        histogram.count = data["count"]
+        histogram.max = data["max"]
+
+        return histogram
+
+    def percentile(self, percent):
+        """Return the value at PERCENT in microseconds"""
+
+        if self.count == 0:
+            return 0
+
+        target = max(1, int(_math.ceil(self.count * percent / 100.0)))
+        total = 0
+
+        for index, count in enumerate(self.counts):
+            total += count
+
+            if total >= target:
+                return min(self._value(index), self.max)
+
+        return self.max
+
+    def summary(self):
+        summary = _collections.OrderedDict()
+        summary["count"] = self.count
+
+        for name, percent in (("p50", 50), ("p90", 90), ("p99", 99), ("p999", 99.9)):
+            summary[name] = round(self.percentile(percent) / 1000.0, 3)
+
+        summary["max"] = round(self.max / 1000.0, 3)
+
+        return summary
+
 DONE = object()
 
 class _InputOutputThread(_threading.Thread):
@@ -238,14 +1249,30 @@ class _InputThread(_InputOutputThread):
         self.command.ready.wait()
 
         with self.command.input_file as f:
-            while True:
-                line = f.readline()
+            if self.command.input_format == "amqp":
+                self.read_frames(f)
+            else:
+                self.read_lines(f)
 
-                if line == "":
-                    self.push_line(DONE)
-                    return
+    def read_lines(self, f):
+        while True:
+            line = f.readline()
 
-                self.push_line(line[:-1])
+            if line == "":
+                self.push_line(DONE)
+                return
+
+            self.push_line(line[:-1])
+
+    def read_frames(self, f):
+        while True:
+            data = read_frame(f)
+
+            if data is None:
+                self.push_line(DONE)
+                return
+
+            self.push_line(data)
 
     def push_line(self, line):
         super(_InputThread, self).push_line(line)
@@ -255,6 +1282,8 @@ class _OutputThread(_InputOutputThread):
     def run(self):
         self.command.ready.wait()
 
+        binary = self.command.output_format == "amqp"
+
         with self.command.output_file as f:
             while True:
                 self.lines_queued.wait()
@@ -267,10 +1296,23 @@ class _OutputThread(_InputOutputThread):
                         break
 
                     if line is DONE:
+                        f.flush()
                         return
 
-                    f.write(line + "\n")
-                    f.flush()
+                    if binary:
+                        f.write(line)
+                    else:
+                        f.write(line + "\n")
+
+                f.flush()
+
+def _split_server(server):
+    try:
+        host, port = server.split(":", 1)
+    except ValueError:
+        host, port = server, 5672
+
+    return host, str(port)
 
 def _summarize(entity):
     if isinstance(entity, _proton.Connection):
@@ -318,94 +1360,227 @@ def _summarize_message(message):
     if desc is None:
         return "message"
 
+    desc = format_body(desc)
+
     if len(desc) > 16:
         desc = "{}...".format(desc[:12])
 
     return "message '{}'".format(desc)
 
+_binary_types = bytes, bytearray, memoryview
+
+def decode_binary(value):
+    # Binary that isn't UTF-8 text is rendered as base64
+
+    value = memoryview(value).tobytes()
+
+    try:
+        return value.decode("utf-8")
+    except UnicodeDecodeError:
+        return _base64.b64encode(value).decode("ascii")
+
+def format_body(body):
+    if isinstance(body, _binary_types):
+        return decode_binary(body)
+
+    if body is None:
+        return ""
+
+    return "{}".format(body)
+
 def process_input_line(line):
     if line.endswith("\n"):
         line = line[:-1]
 
     if line.startswith("{") and line.endswith("}"):
-        data = _json.loads(line)
+        data = _json_loads(line)
         message = convert_data_to_message(data)
     else:
-#        line = unicode(line)
         message = _proton.Message(line)
 
     return message
 
-def convert_data_to_message(data):
-    message = _proton.Message()
-
-    _set_message_attribute(message, "id", data, "id")
-    _set_message_attribute(message, "correlation_id", data, "correlation_id")
-    _set_message_attribute(message, "user", data, "user")
-    _set_message_attribute(message, "address", data, "to")
-    _set_message_attribute(message, "reply_to", data, "reply_to")
-    _set_message_attribute(message, "durable", data, "durable")
-    _set_message_attribute(message, "priority", data, "priority")
-    _set_message_attribute(message, "ttl", data, "ttl")
-    _set_message_attribute(message, "subject", data, "subject")
-    _set_message_attribute(message, "body", data, "body")
-
-    if "properties" in data:
-        props = data["properties"]
-        message.properties = dict()
-
-        for name in props:
-            message.properties[name] = props[name]
+_frame_header = _struct.Struct("!I")
 
-    return message
+def encode_frame(data):
+    return _frame_header.pack(len(data)) + data
 
-def _set_message_attribute(message, mname, data, dname):
-    try:
-        value = data[dname]
-    except KeyError:
-        return
+def read_frame(file):
+    header = file.read(_frame_header.size)
 
-    setattr(message, mname, value)
+    if len(header) < _frame_header.size:
+        return None
 
-def convert_message_to_data(message):
-    data = _collections.OrderedDict()
+    size = _frame_header.unpack(header)[0]
+    data = file.read(size)
 
-    _set_data_attribute(data, "id", message, "id")
-    _set_data_attribute(data, "correlation_id", message, "correlation_id")
-    _set_data_attribute(data, "user", message, "user_id")
-    _set_data_attribute(data, "to", message, "address")
-    _set_data_attribute(data, "reply_to", message, "reply_to")
+    if len(data) < size:
+        return None
 
-    if message.durable:
-        _set_data_attribute(data, "durable", message, "durable")
+    return data
+
+def send_encoded_message(sender, data):
+    delivery = sender.delivery(sender.delivery_tag())
 
-    if message.priority != 4:
-        _set_data_attribute(data, "priority", message, "priority")
+    sender.stream(data)
+    sender.advance()
 
-    if message.ttl != 0:
-        _set_data_attribute(data, "ttl", message, "ttl")
+    if sender.snd_settle_mode == _proton.Link.SND_SETTLED:
+        delivery.settle()
 
-    if message.properties:
-        props = data["properties"] = _collections.OrderedDict()
+    return delivery
 
-        for name in message.properties:
-            props[name] = message.properties[name]
+def receive_encoded_message(delivery):
+    link = delivery.link
+    data = link.recv(delivery.pending)
 
-    _set_data_attribute(data, "subject", message, "subject")
-    _set_data_attribute(data, "body", message, "body")
+    link.advance()
 
     return data
 
-def _set_data_attribute(data, dname, message, mname, omit_if_empty=True):
-    value = getattr(message, mname)
+def binary_file(file):
+    return getattr(file, "buffer", file)
 
-    if omit_if_empty and value in (None, "", b""):
-        return
+if _orjson is None:
+    _json_loads = _json.loads
+    _json_dumps = _json.dumps
+else:
+    _json_loads = _orjson.loads
+
+    def _json_dumps(data):
+        try:
+            return _orjson.dumps(data).decode()
+        except TypeError:
+            return _json.dumps(data)
+
+# (JSON name, message attribute, values omitted from JSON output)
+_message_fields = (
+    ("id", "id", (None, "", b"")),
+    ("correlation_id", "correlation_id", (None, "", b"")),
+    ("user", "user_id", (None, "", b"")),
+    ("to", "address", (None, "", b"")),
+    ("reply_to", "reply_to", (None, "", b"")),
+    ("durable", "durable", (False,)),
+    ("priority", "priority", (4,)),
+    ("ttl", "ttl", (0,)),
+    ("annotations", "annotations", (None, {})),
+    ("properties", "properties", (None, {})),
+    ("subject", "subject", (None, "", b"")),
+    ("group_id", "group_id", (None, "", b"")),
+    ("body", "body", (None, "", b"")),
+)
+
+class MessageCodec(object):
+    """
+    Converts messages to and from their JSON form.
+
+    The field mapping is compiled into getter and setter functions
+    once, when the codec is created.  Decoding reuses a single message
+    object, so the result is valid only until the next call to
+    decode().
+    """
+
+    def __init__(self):
+        self.message = _proton.Message()
+
+        getters = {"annotations": _get_annotations}
+
+        self._getters = [(name, getters.get(name, _operator.attrgetter(attr)), omit)
+                         for name, attr, omit in _message_fields]
+        self._setters = dict((name, _attribute_setter(attr))
+                             for name, attr, omit in _message_fields)
+
+        self._setters["user"] = _set_user_id
+        self._setters["annotations"] = _set_annotations
+        self._setters["properties"] = _set_properties
+
+    def encode(self, message):
+        return _json_dumps(self.message_to_data(message))
+
+    def decode(self, line):
+        if line.endswith("\n"):
+            line = line[:-1]
+
+        message = self.message
+        message.clear()
+
+        if line.startswith("{") and line.endswith("}"):
+            self.data_to_message(_json_loads(line), message)
+        else:
+            message.body = line
+
+        return message
+
+    def message_to_data(self, message):
+        data = _collections.OrderedDict()
+
+        for name, get, omit in self._getters:
+            value = get(message)
+
+            if value in omit:
+                continue
+
+            if isinstance(value, _binary_types):
+                value = decode_binary(value)
+
+            data[name] = value
+
+        return data
 
-    if isinstance(value, bytes):
-        value = value.decode()
+    def data_to_message(self, data, message):
+        setters = self._setters
 
-    data[dname] = value
+        for name in data:
+            try:
+                set_ = setters[name]
+            except KeyError:
+                continue
+
+            set_(message, data[name])
+
+        return message
+
+def _attribute_setter(attr):
+    def set_(message, value):
+        setattr(message, attr, value)
+
+    return set_
+
+def _set_user_id(message, value):
+    if not isinstance(value, bytes):
+        value = value.encode()
+
+    message.user_id = value
+
+def _get_annotations(message):
+    annotations = message.annotations
+
+    if annotations:
+        annotations = dict((str(k), v) for k, v in annotations.items())
+
+    return annotations
+
+def _set_annotations(message, value):
+    message.annotations = dict((_proton.symbol(k), v) for k, v in value.items())
+
+def _set_properties(message, value):
+    message.properties = dict(value)
+
+_default_codec = None
+
+def _get_default_codec():
+    global _default_codec
+
+    if _default_codec is None:
+        _default_codec = MessageCodec()
+
+    return _default_codec
+
+def convert_data_to_message(data):
+    return _get_default_codec().data_to_message(data, _proton.Message())
+
+def convert_message_to_data(message):
+    return _get_default_codec().message_to_data(message)
 
 def unique_id():
     bytes_ = _uuid.uuid4().bytes[:2]
@@ -421,3 +1596,20 @@ def plural(word, count, override=None):
         return override
 
     return word + "s"
+
+class lazy_import(object):
+    """
+    A stand-in for module NAME that imports it on first use.  Use it
+    for modules that are slow to import and needed only by some
+    options.  A missing module raises ImportError at first use.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = _importlib.import_module(self._name)
+
+        return getattr(self._module, attr)
@@ -23,53 +23,98 @@ from __future__ import print_function
 from __future__ import unicode_literals
 from __future__ import with_statement
 
-import collections as _collections
+import binascii as _binascii
 import commandant as _commandant
 import json as _json
+import math as _math
 import proton as _proton
+import random as _random
+import re as _re
 import sys as _sys
 import time as _time
+import uuid as _uuid
 
 from .common import *
+from .common import _attribute_setter
+
+_multiprocessing = lazy_import("multiprocessing")
+_connection = lazy_import("multiprocessing.connection")
 
 _description = "Generate AMQP messages"
 
+_epilog = """
+rate profiles:
+  With --rate, message k is due at a fixed offset from the start, so
+  late messages are caught up in a batch instead of lowering the rate.
+  The --profile option varies the rate between --rate and --peak-rate
+  over each --period:
+
+    constant  Always --rate (the default)
+    step      --rate for the first half of each period, then --peak-rate
+    linear    Ramp from --rate to --peak-rate over one period, then hold
+    sine      Swing smoothly from --rate to --peak-rate and back
+
+field templates:
+  The ID, correlation ID, to, reply-to, subject, body, group ID, and
+  property values can contain expressions in braces, which are
+  evaluated for each message:
+
+    {seq}         The message number, starting at 1
+    {seq % N}     The message number modulo N
+    {rand}        A random 32-bit integer
+    {rand % N}    A random integer from 0 to N - 1
+    {rand:uuid}   A random UUID
+
+  With --group-count COUNT, messages cycle through COUNT group IDs
+  made by appending -0, -1, and so on to --group-id.
+
+payloads:
+  With --body-size, bodies are slices of a random pool generated once
+  at startup, so the cost per message doesn't depend on its size.  The
+  size is fixed or drawn from a uniform, normal, or log-normal
+  distribution with mean --body-size and spread --body-size-spread.
+  Binary bodies require --format amqp, whose output 'qsend --format
+  amqp' reads.
+
+example usage:
+  $ qmessage --count 10 | qsend queue0
+  $ qmessage --count 1000 --body-size 4096 --body-size-distribution lognormal | qsend queue0
+  $ qmessage --count 1000 --body-size 512 --body-content binary --format amqp | qsend queue0 --format amqp
+  $ qmessage --count 1000 --property key '{seq % 100}' --subject 'order-{rand:uuid}' | qsend queue0
+  $ qmessage --count 1000 --group-id session --group-count 10 | qsend queue0
+  $ qmessage --count 100000000 --workers 8 --output corpus.json
+  $ qmessage --rate 100000 --workers 4 --output fifo-{worker}
+  $ qmessage --rate 50000 --profile sine --peak-rate 100000 --period 60 | qsend queue0
+"""
+
 class MessageCommand(_commandant.Command):
     def __init__(self, home_dir):
         super(MessageCommand, self).__init__(home_dir, "qmessage")
 
         self.description = _description
+        self.epilog = _epilog
 
         self.add_argument("--output", metavar="FILE",
                           help="Write messages to FILE (default stdout)")
         self.add_argument("-c", "--count", metavar="COUNT", type=int,
                           help="Exit after generating COUNT messages (default 1)")
-        self.add_argument("--rate", metavar="COUNT", type=int,
+        self.add_argument("--rate", metavar="COUNT", type=float,
                           help="Generate COUNT messages per second")
-
-        self.add_argument("--id", metavar="STRING",
-                          help="Set the message ID")
-        self.add_argument("--correlation-id", metavar="STRING",
-                          help="Set the ID for matching related messages")
-        self.add_argument("--user", metavar="STRING",
-                          help="Set the ID of the user producing the message")
-        self.add_argument("--to", metavar="ADDRESS",
-                          help="Set the target address")
-        self.add_argument("--reply-to", metavar="ADDRESS",
-                          help="Set the address for replies")
-        self.add_argument("--durable", action="store_true",
-                          help="Set the durable flag")
-        self.add_argument("--priority", metavar="INTEGER",
-                          help="Set the priority to INTEGER")
-        self.add_argument("--ttl", metavar="FLOAT",
-                          help="Set the time-to-live to FLOAT seconds")
-        self.add_argument("--subject", metavar="STRING",
-                          help="Set the message summary")
-        self.add_argument("--body", metavar="STRING",
-                          help="Set the main message content")
-        self.add_argument("--property", metavar=("NAME", "VALUE"),
-                          nargs=2, action="append",
-                          help="Set an application property. This option can be repeated.")
+        self.add_argument("--profile", metavar="KIND", choices=sorted(_profiles), default="constant",
+                          help="Vary the rate over time: constant, step, linear, or sine (default constant)")
+        self.add_argument("--peak-rate", metavar="COUNT", type=float,
+                          help="The highest rate for a profile (default twice --rate)")
+        self.add_argument("--period", metavar="SECONDS", type=float, default=10,
+                          help="The length of one profile cycle (default 10)")
+        self.add_argument("--timestamp", action="store_true",
+                          help="Stamp each message with the time it was generated")
+        self.add_argument("--format", metavar="FORMAT", choices=("text", "amqp"), default="text",
+                          help="Write messages in FORMAT: text (JSON lines) or amqp (default text)")
+        self.add_argument("--workers", metavar="COUNT", type=int,
+                          help="Generate messages in COUNT processes.  The rate is split among them.  "
+                          "If the output FILE contains {worker}, each process writes its own file.")
+
+        add_generator_arguments(self)
 
         self.output_file = _sys.stdout
 
@@ -78,90 +123,744 @@ class MessageCommand(_commandant.Command):
 
         self.max_count = self.args.count
         self.rate = self.args.rate
+        self.timestamps_enabled = self.args.timestamp
 
-        self.interval = None
+        self.profile = None
 
         if self.rate is None:
             if self.max_count is None:
                 self.max_count = 1
+
+            if self.args.profile != "constant" or self.args.peak_rate is not None:
+                self.fail("Rate profiles require --rate")
         else:
-            self.interval = 1.0 / self.rate
+            peak_rate = self.args.peak_rate
+
+            if peak_rate is None:
+                peak_rate = 2 * self.rate
+
+            if self.rate <= 0 or peak_rate <= 0:
+                self.fail("The rate must be greater than zero")
+
+            if self.args.period <= 0:
+                self.fail("The period must be greater than zero")
+
+            self.profile = _profiles[self.args.profile](self.rate, peak_rate, self.args.period)
 
             if self.max_count is None:
                 self.max_count = -1
 
-        if self.args.output is not None:
-            self.output_file = open(self.args.output, "w")
+        self.output_format = self.args.format
+        self.workers = self.args.workers
+        self.output_pattern = None
+
+        # This process generates message numbers first, first + step,
+        # and so on
+        self.first = 1
+        self.step = 1
+
+        if self.workers is not None:
+            if self.workers < 1:
+                self.fail("The worker count must be at least 1")
+
+            if self.args.output is not None and "{worker}" in self.args.output:
+                self.output_pattern = self.args.output
+
+        if self.args.body_content == "binary" and self.output_format != "amqp":
+            self.fail("Binary bodies require --format amqp")
+
+        if self.args.output is not None and self.output_pattern is None:
+            mode = "wb" if self.output_format == "amqp" else "w"
+            self.output_file = open(self.args.output, mode)
+        elif self.output_format == "amqp":
+            self.output_file = binary_file(self.output_file)
+
+        self.codec = MessageCodec()
+
+        # In the text format, generated values are spliced into JSON
+        # and so must need no escaping
+        self.generator = MessageGenerator(self, escape=self.output_format == "text")
+        self.batch_size = _batch_size
+
+        # Keep batches of large messages to a few megabytes
+        if self.generator.max_body_size is not None:
+            self.batch_size = max(1, min(_batch_size, _batch_bytes // max(self.generator.max_body_size, 1)))
+
+    def compile_template(self):
+        """
+        Render the message to JSON once, with %-format slots for the
+        generated fields.  Each line is then a single string format
+        operation taking the message number as "n" and the send time
+        as "t".
+        """
+
+        generator = self.generator
+        message = generator.message
+        slots = dict()
+
+        if generator.generate_message_id:
+            message.id = _slot_marker.format("id")
+            slots["id"] = '"{}-%(n)04d"'.format(generator.id_prefix)
+
+        if generator.generate_message_body:
+            message.body = _slot_marker.format("body")
+            slots["body"] = '"message-%(n)04d"'
+
+        if self.timestamps_enabled:
+            stamp_send_time(message, _slot_marker.format("time"))
+            slots["time"] = "%(t)r"
+
+        for key, set_, function in generator.generators:
+            set_(message, _slot_marker.format(key))
+            slots[key] = '"%({})s"'.format(key)
+
+        template = self.codec.encode(message).replace("%", "%%")
+
+        for name, slot in slots.items():
+            template = template.replace('"{}"'.format(_slot_marker.format(name)), slot)
+
+        return template
+
+    def run(self):
+        if self.workers is not None:
+            self.run_workers()
+            return
+
+        self.generate(self.output_file)
+
+    def generate(self, output_file):
+        if self.output_format == "amqp":
+            render = self.render_frames
+        else:
+            render = self.render_lines(self.compile_template())
+
+        with output_file as f:
+            if self.profile is None:
+                self.write_batches(f, render)
+            else:
+                self.write_paced(f, render)
+
+    def run_workers(self):
+        # Worker i generates message numbers i + 1, i + 1 + N, and so
+        # on, so IDs don't overlap.  Each worker sends whole batches
+        # to the parent, which writes them in turn, or writes its own
+        # file if the output name contains {worker}.
+
+        context = _multiprocessing.get_context("fork")
+        processes = list()
+        connections = list()
+
+        for index in range(self.workers):
+            if self.output_pattern is None:
+                reader, writer = context.Pipe(duplex=False)
+                connections.append(reader)
+            else:
+                writer = None
+
+            process = context.Process(target=self.run_worker, args=(index, writer))
+            process.start()
+
+            processes.append(process)
+
+            if writer is not None:
+                writer.close()
+
+        if connections:
+            with binary_file(self.output_file) as f:
+                while connections:
+                    for connection in _connection.wait(connections):
+                        try:
+                            data = connection.recv_bytes()
+                        except EOFError:
+                            connections.remove(connection)
+                            continue
+
+                        f.write(data)
+                        f.flush()
+
+        for process in processes:
+            process.join()
+
+            if process.exitcode != 0:
+                self.fail("Worker {} exited with code {}", process.name, process.exitcode)
+
+    def run_worker(self, index, connection):
+        self.first = index + 1
+        self.step = self.workers
+
+        if self.max_count >= 0:
+            self.max_count = len(range(self.first, self.max_count + 1, self.step))
+
+        if self.profile is not None:
+            self.profile.scale(1 / self.workers)
+
+        self.generator.reseed(index)
+
+        if connection is None:
+            mode = "wb" if self.output_format == "amqp" else "w"
+            output_file = open(self.output_pattern.format(worker=index), mode)
+        else:
+            output_file = _ConnectionFile(connection)
+
+        self.generate(output_file)
+
+    def render_lines(self, template):
+        generators = self.generator.generators
+        timestamps_enabled = self.timestamps_enabled
+        time = _time.time
+
+        # render(numbers) returns the output for the given message
+        # numbers
+
+        if not generators:
+            if timestamps_enabled:
+                return lambda numbers: [template % {"n": n, "t": time()} for n in numbers]
+
+            return lambda numbers: [template % {"n": n} for n in numbers]
+
+        def render(numbers):
+            lines = list()
+
+            for n in numbers:
+                values = {"n": n}
+
+                if timestamps_enabled:
+                    values["t"] = time()
+
+                for key, set_, function in generators:
+                    values[key] = function(n)
+
+                lines.append(template % values)
+
+            return lines
+
+        return render
+
+    def render_frames(self, numbers):
+        create_message = self.generator.create_message
+        frames = list()
+
+        for n in numbers:
+            message = create_message(n)
+
+            if self.timestamps_enabled:
+                stamp_send_time(message)
+
+            frames.append(encode_frame(message.encode()))
+
+        return frames
+
+    def write(self, f, items):
+        if self.output_format == "amqp":
+            f.write(b"".join(items))
+        else:
+            items.append("")
+            f.write("\n".join(items))
+
+        f.flush()
+
+    def write_paced(self, f, render):
+        # Message k, counting from zero, is due when the profile's
+        # cumulative count reaches k.  Everything due is written in
+        # one batch, then we sleep until the next message is due.
+
+        profile = self.profile
+        first, step = self.first, self.step
+        time = _time.time
+        start_time = time()
+        count = 0
+
+        while count != self.max_count:
+            now = time()
+            elapsed = now - start_time
+            due = min(int(profile.count(elapsed)) + 1, count + self.batch_size)
+
+            if self.max_count >= 0:
+                due = min(due, self.max_count)
+
+            if due > count:
+                self.write(f, render(range(first + count * step, first + due * step, step)))
+
+                count = due
+                continue
+
+            delay = (count - profile.count(elapsed)) / profile.rate(elapsed)
+            _time.sleep(min(max(delay, 0), 0.1))
+
+    def write_batches(self, f, render):
+        numbers = range(self.first, self.first + self.max_count * self.step, self.step)
+
+        for start in range(0, len(numbers), self.batch_size):
+            self.write(f, render(numbers[start:start + self.batch_size]))
+
+def add_generator_arguments(command, id_option="--id", reply_to=True):
+    """
+    Add the message field and payload options read by
+    MessageGenerator.  qsend and qrequest use --id for the container
+    identity, so they give the message ID option another name.
+    qrequest sets the ID and reply-to address itself and passes None
+    and False to leave them out.
+    """
+
+    if id_option is None:
+        command.parser.set_defaults(message_id=None)
+    else:
+        command.add_argument(id_option, dest="message_id", metavar="STRING",
+                             help="Set the message ID")
+
+    command.add_argument("--correlation-id", metavar="STRING",
+                         help="Set the ID for matching related messages")
+    command.add_argument("--user", metavar="STRING",
+                         help="Set the ID of the user producing the message")
+    command.add_argument("--to", metavar="ADDRESS",
+                         help="Set the target address")
+
+    if reply_to:
+        command.add_argument("--reply-to", metavar="ADDRESS",
+                             help="Set the address for replies")
+    else:
+        command.parser.set_defaults(reply_to=None)
+
+    command.add_argument("--durable", action="store_true",
+                         help="Set the durable flag")
+    command.add_argument("--priority", metavar="INTEGER",
+                         help="Set the priority to INTEGER")
+    command.add_argument("--ttl", metavar="FLOAT",
+                         help="Set the time-to-live to FLOAT seconds")
+    command.add_argument("--subject", metavar="STRING",
+                         help="Set the message summary")
+    command.add_argument("--body", metavar="STRING",
+                         help="Set the main message content")
+    command.add_argument("--group-id", metavar="STRING",
+                         help="Set the ID of the group the message belongs to")
+    command.add_argument("--group-count", metavar="COUNT", type=int,
+                         help="Cycle through COUNT group IDs")
+    command.add_argument("--property", metavar=("NAME", "VALUE"),
+                         nargs=2, action="append",
+                         help="Set an application property. This option can be repeated.")
+    command.add_argument("--body-size", metavar="BYTES", type=int,
+                         help="Generate random bodies of BYTES bytes (the mean, for distributions)")
+    command.add_argument("--body-size-distribution", metavar="KIND", choices=sorted(_size_distributions),
+                         default="fixed",
+                         help="Draw body sizes from a fixed, uniform, normal, or lognormal distribution (default fixed)")
+    command.add_argument("--body-size-spread", metavar="BYTES", type=int,
+                         help="The half-width (uniform) or standard deviation of body sizes (default half the size)")
+    command.add_argument("--body-content", metavar="KIND", choices=("text", "binary"), default="text",
+                         help="Generate text or binary bodies (default text)")
+    command.add_argument("--seed", metavar="INTEGER", type=int,
+                         help="Seed the random generator for repeatable output")
+
+def generator_options_used(command):
+    """
+    Return True if any option added by add_generator_arguments has a
+    value other than its default
+    """
+
+    for name in _generator_options:
+        if getattr(command.args, name) != command.parser.get_default(name):
+            return True
+
+    return False
+
+_generator_options = (
+    "message_id", "correlation_id", "user", "to", "reply_to", "durable", "priority", "ttl",
+    "subject", "body", "group_id", "group_count", "property",
+    "body_size", "body_size_distribution", "body_size_spread", "body_content", "seed",
+)
+
+class MessageGenerator(object):
+    """
+    Builds messages from the options added by add_generator_arguments.
+    create_message(n) fills in and returns the nth message, counting
+    from 1.  It returns the same message object each time.
+    """
+
+    def __init__(self, command, escape=False):
+        self.command = command
+        self.args = command.args
+
+        # With escape, template literals are escaped for JSON
+        self.escape = escape
+
+        self.seed = self.args.seed
+        self.random = _random.Random(self.seed)
+
+        # Per-message field values: (slot key, setter, function of
+        # the message number)
+        self.generators = list()
+
+        # The largest generated body, if bodies are generated
+        self.max_body_size = None
 
         self.init_message()
+        self.init_payloads()
 
     def init_message(self):
+        args = self.args
+
         self.message = _proton.Message()
-        self.message.id = self.args.id
-        self.message.correlation_id = self.args.correlation_id
-        self.message.address = self.args.to
-        self.message.reply_to = self.args.reply_to
-        self.message.subject = self.args.subject
-        self.message.body = self.args.body
-        self.message.durable = self.args.durable
-
-        if self.args.user is not None:
-            self.message.user_id = self.args.user.encode()
-
-        if self.args.priority is not None:
+        self.message.id = args.message_id
+        self.message.correlation_id = args.correlation_id
+        self.message.address = args.to
+        self.message.reply_to = args.reply_to
+        self.message.subject = args.subject
+        self.message.body = args.body
+        self.message.group_id = args.group_id
+        self.message.durable = args.durable
+
+        if args.user is not None:
+            self.message.user_id = args.user.encode()
+
+        if args.priority is not None:
             try:
-                priority = int(self.args.priority)
+                priority = int(args.priority)
             except ValueError:
-                self.fail("Priority value must be an integer")
+                self.command.fail("Priority value must be an integer")
 
             self.message.priority = priority
 
-        if self.args.ttl is not None:
+        if args.ttl is not None:
             try:
-                ttl = float(self.args.ttl)
+                ttl = float(args.ttl)
             except ValueError:
-                self.fail("TTL value must be a float")
+                self.command.fail("TTL value must be a float")
 
             self.message.ttl = ttl
 
-        self.message.properties = _collections.OrderedDict()
+        properties = dict()
+
+        if args.property is not None:
+            for name, value in args.property:
+                properties[name] = value
+
+        self.message.properties = properties
+
+        self.generate_message_id = self.message.id is None
+        self.generate_message_body = self.message.body is None
+
+        self.id_prefix = unique_id()
+
+        if self.seed is not None:
+            self.id_prefix = "{:04x}".format(self.random.getrandbits(16))
+
+        self.init_templates()
+
+    def init_templates(self):
+        group_count = self.args.group_count
+
+        if group_count is not None:
+            if group_count < 1:
+                self.command.fail("The group count must be at least 1")
+
+            group_id = self.message.group_id
+
+            if group_id is None:
+                group_id = "group"
 
-        if self.args.property is not None:
-            for name, value in self.args.property:
-                self.message.properties[name] = value
+            self.message.group_id = "{}-{{seq % {}}}".format(group_id, group_count)
+
+        fields = [
+            (self.message.id, _attribute_setter("id")),
+            (self.message.correlation_id, _attribute_setter("correlation_id")),
+            (self.message.address, _attribute_setter("address")),
+            (self.message.reply_to, _attribute_setter("reply_to")),
+            (self.message.subject, _attribute_setter("subject")),
+            (self.message.group_id, _attribute_setter("group_id")),
+            (self.message.body, _attribute_setter("body")),
+        ]
+
+        for name, value in self.message.properties.items():
+            fields.append((value, _property_setter(name)))
+
+        for value, set_ in fields:
+            if value is None:
+                continue
+
+            try:
+                function = _compile_template(value, self.random, self.escape)
+            except ValueError as e:
+                self.command.fail("Invalid template '{}': {}", value, e)
+
+            if function is None:
+                continue
+
+            self.generators.append(("g{}".format(len(self.generators)), set_, function))
+
+    def init_payloads(self):
+        args = self.args
+        size = args.body_size
+
+        if size is None:
+            if args.body_content != "text" or args.body_size_distribution != "fixed" \
+               or args.body_size_spread is not None:
+                self.command.fail("The body options require --body-size")
+
+            return
+
+        if args.body is not None:
+            self.command.fail("The --body and --body-size options cannot be used together")
+
+        if size < 0:
+            self.command.fail("The body size cannot be negative")
+
+        spread = args.body_size_spread
+
+        if spread is None:
+            spread = size // 2
+
+        if spread < 0:
+            self.command.fail("The body size spread cannot be negative")
+
+        sizes, max_size = _size_distributions[args.body_size_distribution](self.random, size, spread)
+        pool = _random_pool(self.random, max(2 * max_size, 65536), args.body_content == "binary")
+
+        randrange = self.random.randrange
+        pool_size = len(pool)
+
+        def body(n):
+            size = sizes()
+            offset = randrange(pool_size - size + 1)
+
+            return pool[offset:offset + size]
 
-        self.generate_message_id = False
         self.generate_message_body = False
+        self.generators.append(("body", _attribute_setter("body"), body))
+        self.max_body_size = max_size
 
-        if self.message.id is None:
-            self.generate_message_id = True
+    def reseed(self, index):
+        # The compiled generators share this random object, so reseed
+        # it in place to give each worker process its own stream
 
-        if self.message.body is None:
-            self.generate_message_body = True
+        if self.seed is None:
+            self.random.seed()
+        else:
+            self.random.seed(self.seed + index)
 
-        self.id_prefix = unique_id()
+    def create_message(self, n):
+        message = self.message
 
-    def run(self):
-        count = 0
+        if self.generate_message_id:
+            message.id = "{}-{:04}".format(self.id_prefix, n)
+
+        if self.generate_message_body:
+            message.body = "message-{:04}".format(n)
+
+        for key, set_, function in self.generators:
+            set_(message, function(n))
+
+        return message
+
+class _ConnectionFile(object):
+    # Sends each write to the parent process as one message
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.connection.close()
+
+    def write(self, data):
+        if not isinstance(data, bytes):
+            data = data.encode()
+
+        self.connection.send_bytes(data)
+
+    def flush(self):
+        pass
+
+def _property_setter(name):
+    def set_(message, value):
+        properties = message.properties
+        properties[name] = value
+        message.properties = properties
+
+    return set_
+
+_template_expression = _re.compile(r"\{\s*(seq|rand)\s*(?:%\s*(\d+)\s*|:\s*(uuid)\s*)?\}")
+
+def _compile_template(text, random, escape):
+    """
+    Compile a field template into a function of the message number,
+    or return None if the text has no expressions.  With escape, the
+    literal parts are escaped for JSON.
+    """
+
+    parts = _template_expression.split(text)
+
+    if len(parts) == 1:
+        return None
+
+    literals = parts[0::4]
+    functions = [_compile_expression(name, modulus, kind, random)
+                 for name, modulus, kind in zip(parts[1::4], parts[2::4], parts[3::4])]
+
+    if escape:
+        literals = [_json.dumps(x)[1:-1] for x in literals]
+
+    format_ = "%s".join(x.replace("%", "%%") for x in literals)
+
+    if len(functions) == 1:
+        function = functions[0]
+        return lambda n: format_ % function(n)
+
+    return lambda n: format_ % tuple(f(n) for f in functions)
+
+def _compile_expression(name, modulus, kind, random):
+    if modulus:
+        modulus = int(modulus)
+
+        if modulus < 1:
+            raise ValueError("The modulus must be at least 1")
+
+    if name == "seq":
+        if modulus:
+            return lambda n: n % modulus
+
+        return lambda n: n
+
+    getrandbits = random.getrandbits
+
+    if kind == "uuid":
+        return lambda n: str(_uuid.UUID(int=getrandbits(128), version=4))
+
+    if modulus:
+        randrange = random.randrange
+        return lambda n: randrange(modulus)
+
+    return lambda n: getrandbits(32)
+
+# Text bodies use 64 characters that need no JSON escaping
+_text_alphabet = b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_"
+_text_table = bytes(bytearray(_text_alphabet[i % 64] for i in range(256)))
+
+def _random_pool(random, size, binary):
+    # Equivalent to int.to_bytes(size, "little"), which Python 2 lacks
+    data = _binascii.unhexlify("%0*x" % (2 * size, random.getrandbits(8 * size)))[::-1]
+
+    if binary:
+        return data
+
+    return data.translate(_text_table).decode("ascii")
+
+def _fixed_sizes(random, size, spread):
+    return (lambda: size), size
+
+def _uniform_sizes(random, size, spread):
+    low = max(0, size - spread)
+    high = size + spread
+    randint = random.randint
+
+    return (lambda: randint(low, high)), high
+
+def _normal_sizes(random, size, spread):
+    high = size + 4 * spread
+    gauss = random.gauss
+
+    return (lambda: min(max(0, int(gauss(size, spread))), high)), high
+
+def _lognormal_sizes(random, size, spread):
+    if size == 0:
+        return _fixed_sizes(random, size, spread)
+
+    # Choose mu and sigma so the distribution has the requested mean
+    # and standard deviation
+
+    sigma = _math.sqrt(_math.log(1 + (spread / size) ** 2))
+    mu = _math.log(size) - sigma * sigma / 2
+    high = int(_math.exp(mu + 4 * sigma)) + 1
+    lognormvariate = random.lognormvariate
+
+    return (lambda: min(int(lognormvariate(mu, sigma)), high)), high
+
+_size_distributions = {
+    "fixed": _fixed_sizes,
+    "uniform": _uniform_sizes,
+    "normal": _normal_sizes,
+    "lognormal": _lognormal_sizes,
+}
+
+# Unlikely to appear in user-supplied fields, and needs no JSON escaping
+_slot_marker = "@@qtools-slot-{}@@"
+
+_batch_size = 4096
+_batch_bytes = 4 * 1024 * 1024
+
+class _ConstantProfile(object):
+    """
+    A rate that varies over time.  rate(t) is the rate at t seconds
+    from the start, and count(t) is its integral, the number of
+    messages due by then.
+    """
+
+    def __init__(self, rate, peak_rate, period):
+        self.base_rate = rate
+        self.peak_rate = peak_rate
+        self.period = period
+
+    def scale(self, factor):
+        self.base_rate *= factor
+        self.peak_rate *= factor
+
+    def rate(self, t):
+        return self.base_rate
+
+    def count(self, t):
+        return self.base_rate * t
+
+class _StepProfile(_ConstantProfile):
+    def rate(self, t):
+        if t % self.period < self.period / 2:
+            return self.base_rate
+
+        return self.peak_rate
+
+    def count(self, t):
+        half = self.period / 2
+        cycles, t = divmod(t, self.period)
+        count = cycles * half * (self.base_rate + self.peak_rate)
+
+        if t < half:
+            return count + self.base_rate * t
+
+        return count + self.base_rate * half + self.peak_rate * (t - half)
+
+class _LinearProfile(_ConstantProfile):
+    def rate(self, t):
+        if t >= self.period:
+            return self.peak_rate
+
+        return self.base_rate + (self.peak_rate - self.base_rate) * t / self.period
+
+    def count(self, t):
+        slope = (self.peak_rate - self.base_rate) / self.period
+
+        if t < self.period:
+            return self.base_rate * t + slope * t * t / 2
 
-        with self.output_file as f:
-            while count != self.max_count:
-                count += 1
-                start_time = _time.time()
+        ramp = self.base_rate * self.period + slope * self.period * self.period / 2
 
-                if self.generate_message_id:
-                    self.message.id = "{}-{:04}".format(self.id_prefix, count)
+        return ramp + self.peak_rate * (t - self.period)
 
-                if self.generate_message_body:
-                    self.message.body = "message-{:04}".format(count)
+class _SineProfile(_ConstantProfile):
+    def rate(self, t):
+        middle = (self.base_rate + self.peak_rate) / 2
+        amplitude = (self.peak_rate - self.base_rate) / 2
 
-                data = convert_message_to_data(self.message)
+        return middle - amplitude * _math.cos(2 * _math.pi * t / self.period)
 
-                _json.dump(data, f)
+    def count(self, t):
+        middle = (self.base_rate + self.peak_rate) / 2
+        amplitude = (self.peak_rate - self.base_rate) / 2
+        omega = 2 * _math.pi / self.period
 
-                f.write("\n")
-                f.flush()
+        return middle * t - amplitude * _math.sin(omega * t) / omega
 
-                if self.interval is not None:
-                    adjusted = max(0, self.interval - (_time.time() - start_time))
-                    _time.sleep(adjusted)
+_profiles = {
+    "constant": _ConstantProfile,
+    "step": _StepProfile,
+    "linear": _LinearProfile,
+    "sine": _SineProfile,
+}
@@ -23,7 +23,6 @@ from __future__ import print_function
 from __future__ import unicode_literals
 from __future__ import with_statement
 
-import json as _json
 import os as _os
 import proton as _proton
 import proton.reactor as _reactor
@@ -37,6 +36,7 @@ _epilog = """
 example usage:
   $ qreceive //example.net/queue0
   $ qreceive queue0 queue1 > messages.txt
+  $ qreceive queue0 --format amqp > messages.amqp
 """
 
 class ReceiveCommand(MessagingCommand):
@@ -47,11 +47,16 @@ class ReceiveCommand(MessagingCommand):
         self.epilog = url_epilog + _epilog
 
         self.add_link_arguments()
+        self.add_latency_arguments("end-to-end")
 
         self.add_argument("--output", metavar="FILE",
                           help="Write messages to FILE (default stdout)")
+        self.add_argument("--format", metavar="FORMAT",
+                          choices=("text", "json", "amqp"), default="text",
+                          help="Write messages in FORMAT: text, json, or amqp (default text).  "
+                          "The amqp format is the encoded message with a length prefix.")
         self.add_argument("--json", action="store_true",
-                          help="Write messages in JSON format")
+                          help="Write messages in JSON format (same as --format json)")
         self.add_argument("--annotations", action="store_true",
                           help="Print delivery and message annotations")
         self.add_argument("--properties", action="store_true",
@@ -68,19 +73,42 @@ class ReceiveCommand(MessagingCommand):
 
         self.init_link_attributes()
 
-        self.json_enabled = self.args.json
+        self.output_format = self.args.format
+
+        if self.args.json:
+            self.output_format = "json"
+
+        self.json_enabled = self.output_format == "json"
         self.annotations_enabled = self.args.annotations
         self.properties_enabled = self.args.properties
         self.router_trace_enabled = self.args.router_trace
         self.prefix_disabled = self.args.no_prefix
         self.max_count = self.args.count
 
+        if self.args.latency_output is not None and self.output_format == "amqp":
+            self.fail("The amqp output format does not decode messages, so latency cannot be measured")
+
+        self.init_latency_attributes()
+
+        if self.output_format == "amqp":
+            if self.annotations_enabled or self.properties_enabled or self.router_trace_enabled:
+                self.fail("The amqp output format cannot be combined with "
+                          "--annotations, --properties, or --router-trace")
+
+            self.output_file = binary_file(self.output_file)
+
         if self.args.output is not None:
-            self.output_file = open(self.args.output, "w")
-            
+            mode = "wb" if self.output_format == "amqp" else "w"
+            self.output_file = open(self.args.output, mode)
+
     def run(self):
         self.output_thread.start()
-        super(ReceiveCommand, self).run()
+
+        try:
+            super(ReceiveCommand, self).run()
+        except KeyboardInterrupt:
+            self.report_latency("End-to-end")
+            raise
 
 class _Handler(LinkHandler):
     def __init__(self, command):
@@ -91,6 +119,39 @@ class _Handler(LinkHandler):
     def open_links(self, event, connection, address):
         return event.container.create_receiver(connection, address),
 
+    def on_delivery(self, event):
+        # In amqp format, take the encoded bytes before the default
+        # incoming message handler decodes them
+
+        super(_Handler, self).on_delivery(event)
+
+        if self.command.output_format != "amqp":
+            return
+
+        delivery = event.delivery
+
+        if delivery.aborted or not delivery.readable or delivery.partial:
+            return
+
+        data = receive_encoded_message(delivery)
+
+        self.accept(delivery)
+
+        if self.done_receiving:
+            return
+
+        self.received_messages += 1
+
+        self.command.output_thread.push_line(encode_frame(data))
+
+        if self.command.verbose:
+            self.command.info("Received {} from {} on {}",
+                              delivery,
+                              event.link.source,
+                              event.connection)
+
+        self.check_done(event)
+
     def on_message(self, event):
         if self.done_receiving:
             return
@@ -100,6 +161,8 @@ class _Handler(LinkHandler):
         message = event.message
         extra_info = False
 
+        self.command.stats.record_latency(message)
+
         if self.command.annotations_enabled:
             if message.instructions is not None:
                 for name in sorted(message.instructions):
@@ -131,19 +194,21 @@ class _Handler(LinkHandler):
             out.append(prefix)
 
         if self.command.json_enabled:
-            data = convert_message_to_data(message)
-            json = _json.dumps(data)
-            out.append(json)
+            out.append(self.command.codec.encode(message))
         else:
-            out.append(message.body)
+            out.append(format_body(message.body))
+
+        self.command.output_thread.push_line("".join(out))
 
-        self.write_line("".join(out))
+        if self.command.verbose:
+            self.command.info("Received {} from {} on {}",
+                              message,
+                              event.link.source,
+                              event.connection)
 
-        self.command.info("Received {} from {} on {}",
-                          message,
-                          event.link.source,
-                          event.connection)
+        self.check_done(event)
 
+    def check_done(self, event):
         if self.received_messages == self.command.max_count:
             self.command.output_thread.push_line(DONE)
             self.done_receiving = True
@@ -156,6 +221,8 @@ class _Handler(LinkHandler):
                             self.received_messages,
                             plural("message", self.received_messages))
 
+        self.command.report_latency("End-to-end")
+
     def write_line(self, template="", *args):
         line = template.format(*args)
         self.command.output_thread.push_line(line)
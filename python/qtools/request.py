@@ -24,19 +24,28 @@ from __future__ import unicode_literals
 from __future__ import with_statement
 
 import collections as _collections
-import json as _json
 import proton as _proton
 import proton.reactor as _reactor
 import sys as _sys
+import time as _time
 
 from .common import *
+from .message import MessageGenerator, add_generator_arguments, generator_options_used
 
 _description = "Send AMQP requests"
 
 _epilog = """
+generated requests:
+  With --generate, qrequest builds requests itself instead of reading
+  them, using the field, template, and payload options of qmessage.
+  qrequest sets the message ID and reply-to address.  Without --rate,
+  --count defaults to 1.  Binary bodies are allowed.  Responses with
+  binary bodies that aren't UTF-8 print as base64.
+
 example usage:
   $ qrequest //example.net/queue0 -m abc -m xyz
   $ qrequest queue0 queue1 < messages.txt
+  $ qrequest queue0 --generate --count 10000 --body-size 256 --max-outstanding 100
 """
 
 class RequestCommand(MessagingCommand):
@@ -47,6 +56,8 @@ class RequestCommand(MessagingCommand):
         self.epilog = url_epilog + _epilog
 
         self.add_link_arguments()
+        self.add_rate_arguments()
+        self.add_latency_arguments("round-trip")
 
         self.add_argument("-m", "--message", metavar="CONTENT",
                           action="append", default=list(),
@@ -61,15 +72,53 @@ class RequestCommand(MessagingCommand):
                           help="Suppress address prefix")
         self.add_argument("--presettled", action="store_true",
                           help="Send messages fire-and-forget (at-most-once delivery)")
+        self.add_argument("--shared-reply", action="store_true",
+                          help="Use one reply receiver per connection instead of one per target")
+        self.add_argument("--max-outstanding", metavar="COUNT", type=int,
+                          help="Wait for responses when COUNT requests are outstanding (default unlimited)")
+        self.add_argument("--timeout", metavar="SECONDS", type=float,
+                          help="Give up on a request if no response arrives within SECONDS")
+        self.add_argument("--retries", metavar="COUNT", type=int, default=0,
+                          help="Resend a timed-out request up to COUNT times (default 0)")
+        self.add_argument("--generate", action="store_true",
+                          help="Generate request messages instead of reading them")
+        self.add_argument("-c", "--count", metavar="COUNT", type=int,
+                          help="With --generate, exit after sending COUNT requests "
+                          "(default 1, or no limit with --rate)")
+
+        add_generator_arguments(self, id_option=None, reply_to=False)
 
     def init(self):
         super(RequestCommand, self).init()
 
         self.init_link_attributes()
+        self.init_rate_attributes()
 
         self.json_enabled = self.args.json
         self.prefix_disabled = self.args.no_prefix
         self.presettled = self.args.presettled
+        self.shared_reply = self.args.shared_reply
+        self.max_outstanding = self.args.max_outstanding
+        self.timeout = self.args.timeout
+        self.retries = self.args.retries
+
+        if self.max_outstanding is not None and self.max_outstanding < 1:
+            self.fail("The outstanding request limit must be at least 1")
+
+        if self.timeout is not None and self.timeout <= 0:
+            self.fail("The timeout must be greater than zero")
+
+        if self.retries and self.timeout is None:
+            self.fail("The --retries option requires --timeout")
+
+        self.init_latency_attributes()
+
+        self.generator = None
+
+        if self.args.generate:
+            self.init_generator()
+        elif self.args.count is not None or generator_options_used(self):
+            self.fail("The --count and message field options require --generate")
 
         if self.args.input is not None:
             self.input_file = open(self.args.input, "r")
@@ -83,22 +132,85 @@ class RequestCommand(MessagingCommand):
 
             self.input_thread.push_line(DONE)
 
+    def init_generator(self):
+        if self.args.message or self.args.input is not None:
+            self.fail("The --generate option cannot be used with --message or --input")
+
+        # Request IDs come from the handler, for matching responses
+        self.generator = MessageGenerator(self)
+        self.generator.generate_message_id = False
+
+        self.max_count = self.args.count
+
+        if self.max_count is None:
+            self.max_count = 1 if self.rate is None else -1
+
+        # Without --to, each request goes to its sender's target
+        self.generated_address = self.args.to is None
+
+        # Without --correlation-id, each request's correlation ID is
+        # its message ID
+        self.generated_correlation_id = self.args.correlation_id is None
+
     def run(self):
-        self.input_thread.start()
+        if self.generator is None:
+            self.input_thread.start()
+
         self.output_thread.start()
 
-        super(RequestCommand, self).run()
+        try:
+            super(RequestCommand, self).run()
+        except KeyboardInterrupt:
+            self.report_latency("Round-trip")
+            raise
+
+class _Request(object):
+    def __init__(self, id, keys, sender, data):
+        self.id = id
+        self.keys = keys
+        self.sender = sender
+        self.data = data
+        self.attempts = 1
+        self.send_time = None
+
+    def __repr__(self):
+        return "request '{}'".format(self.id)
 
 class _Handler(LinkHandler):
     def __init__(self, command):
         super(_Handler, self).__init__(command)
 
-        self.senders = _collections.deque()
         self.receivers_by_sender = dict()
-        self.senders_by_receiver = dict()
+        self.receivers_by_connection = dict()
+
+        # Requests awaiting responses, by request ID, oldest first.
+        # Request IDs are assigned here, so they are always unique.
+        self.outstanding = _collections.OrderedDict()
+
+        # Outstanding requests by the message and correlation IDs a
+        # response may carry.  Input can repeat IDs, so each key holds
+        # its requests in send order.
+        self.requests_by_key = dict()
+        self.deadlines = None
+
+        self.id_prefix = unique_id()
 
         self.sent_requests = 0
         self.received_responses = 0
+        self.retried_requests = 0
+        self.timed_out_requests = 0
+        self.late_responses = 0
+
+    def on_start(self, event):
+        super(_Handler, self).on_start(event)
+
+        timeout = self.command.timeout
+
+        if timeout is not None:
+            resolution = min(timeout / 10, 0.1)
+
+            self.deadlines = TimerWheel(resolution)
+            self.start_timer(event, resolution, self.expire_requests)
 
     def open_links(self, event, connection, address):
         options = None
@@ -107,100 +219,267 @@ class _Handler(LinkHandler):
             options = _reactor.AtMostOnce()
 
         sender = event.container.create_sender(connection, address, options=options)
+        self.senders.appendleft(sender)
+
+        # In shared mode, responses for every target on the
+        # connection arrive on one receiver and are routed back to
+        # their requests by correlation ID
+
+        if self.command.shared_reply and connection in self.receivers_by_connection:
+            self.receivers_by_sender[sender] = self.receivers_by_connection[connection]
+            return sender,
+
         receiver = event.container.create_receiver(connection, None, dynamic=True)
 
-        self.senders.appendleft(sender)
         self.receivers_by_sender[sender] = receiver
-        self.senders_by_receiver[receiver] = sender
+        self.receivers_by_connection[connection] = receiver
 
         return sender, receiver
 
     def on_input(self, event):
-        self.send_message(event)
+        self.send_messages(event)
 
     def on_sendable(self, event):
-        self.send_message(event)
+        self.send_messages(event)
 
-    def send_message(self, event):
+    def send_message(self, event, sender):
         if not self.command.ready.is_set():
-            return
+            return False
 
         if self.done_sending:
-            return
+            return False
+
+        if not sender.credit:
+            return False
 
-        sender = event.link
+        max_outstanding = self.command.max_outstanding
 
-        if sender is None:
-            sender = self.senders.pop()
-            self.senders.appendleft(sender)
+        if max_outstanding is not None and len(self.outstanding) >= max_outstanding:
+            return False
 
-        if not sender.credit:
-            return
+        if not self.message_due():
+            return False
 
-        try:
-            line = self.command.input_thread.lines.pop()
-        except IndexError:
-            return
+        if self.command.generator is not None:
+            if self.sent_requests == self.command.max_count:
+                line = DONE
+            else:
+                line = None
+        else:
+            try:
+                line = self.command.input_thread.lines.pop()
+            except IndexError:
+                return False
 
         if line is DONE:
             self.done_sending = True
+            self.check_done(event)
 
-            if self.sent_requests == self.received_responses:
-                self.close(event)
-
-            return
+            return False
 
         receiver = self.receivers_by_sender[sender]
 
-        message = process_input_line(line)
+        request_id = "{}-{}".format(self.id_prefix, self.sent_requests + 1)
+
+        if line is None:
+            message = self.command.generator.create_message(self.sent_requests + 1)
+            message.id = request_id
+
+            if self.command.generated_address:
+                message.address = sender.target.address
+
+            if self.command.generated_correlation_id:
+                message.correlation_id = request_id
+        else:
+            message = self.command.codec.decode(line)
+
+            if message.address is None:
+                message.address = sender.target.address
+
+            if message.id is None:
+                message.id = request_id
+
+            if message.correlation_id is None:
+                message.correlation_id = message.id
+
+        # Responders echo either the message ID or the correlation ID
+        keys = (message.id,)
+
+        if message.correlation_id != message.id:
+            keys += (message.correlation_id,)
+
         message.reply_to = receiver.remote_source.address
 
-        if message.address is None:
-            message.address = sender.target.address
+        now = _time.time()
+        send_time = now
 
-        if message.id is None:
-            message.id = unique_id()
+        if self.schedule is not None:
+            send_time = self.schedule.advance()
 
-        delivery = sender.send(message)
+        data = message.encode()
+        delivery = self.transfer(sender, data, send_time)
 
         self.sent_requests += 1
 
-        self.command.info("Sent request {} as {} to {} on {}",
-                          message,
-                          delivery,
-                          sender.target,
-                          sender.connection)
+        # Keep the encoded request if it may be sent again
+        keep_data = self.command.retries or self.command.reconnect_enabled
+
+        request = _Request(request_id, keys, sender, data if keep_data else None)
+        request.send_time = send_time
+
+        self.add_request(request)
+
+        if self.deadlines is not None:
+            self.deadlines.add(now + self.command.timeout, request)
+
+        if self.command.verbose:
+            self.command.info("Sent request {} as {} to {} on {}",
+                              message,
+                              delivery,
+                              sender.target,
+                              sender.connection)
+
+        return True
+
+    def add_request(self, request):
+        self.outstanding[request.id] = request
+
+        for key in request.keys:
+            self.requests_by_key.setdefault(key, _collections.deque()).append(request)
+
+    def remove_request(self, request):
+        del self.outstanding[request.id]
+
+        for key in request.keys:
+            requests = self.requests_by_key[key]
+            requests.remove(request)
+
+            if not requests:
+                del self.requests_by_key[key]
+
+    def find_request(self, correlation_id):
+        # Without a correlation ID, match the oldest request
+
+        if correlation_id is None:
+            for request in self.outstanding.values():
+                return request
+
+            return None
+
+        requests = self.requests_by_key.get(correlation_id)
+
+        if requests:
+            return requests[0]
+
+    def queue_resends(self, connection):
+        # After a reconnect, responses to outstanding requests would go
+        # to the old reply address, so send them all again, whether
+        # or not the peer settled them
+
+        for delivery in list(self.unsettled):
+            if delivery.link.connection == connection:
+                del self.unsettled[delivery]
+
+        count = 0
+
+        for request in self.outstanding.values():
+            if request.sender.connection == connection:
+                self.resends.append((request.sender, request, request.send_time))
+                count += 1
+
+        return count
+
+    def resend_message(self, sender, request, send_time):
+        if self.outstanding.get(request.id) is not request:
+            return
+
+        message = _proton.Message()
+        message.decode(request.data)
+        message.reply_to = self.receivers_by_sender[sender].remote_source.address
+        request.data = message.encode()
+
+        super(_Handler, self).resend_message(sender, request.data, send_time)
+
+    def expire_requests(self, event):
+        now = _time.time()
+
+        for request in self.deadlines.expire(now):
+            if self.outstanding.get(request.id) is not request:
+                continue
+
+            if request.attempts <= self.command.retries:
+                request.attempts += 1
+                self.retried_requests += 1
+
+                self.transfer(request.sender, request.data)
+                self.deadlines.add(now + self.command.timeout, request)
+
+                if self.command.verbose:
+                    self.command.info("Resent {} (attempt {})", request, request.attempts)
+
+                continue
+
+            self.remove_request(request)
+            self.timed_out_requests += 1
+
+            if self.command.verbose:
+                self.command.info("Gave up on {} after {} {}",
+                                  request,
+                                  request.attempts,
+                                  plural("attempt", request.attempts))
+
+        self.check_done(event)
+        self.send_messages(event)
 
     def on_message(self, event):
         if self.done_receiving:
             return
 
         message = event.message
+        request = self.find_request(message.correlation_id)
+
+        if request is None:
+            self.late_responses += 1
 
+            if self.command.verbose:
+                self.command.info("Ignored response {} with no outstanding request", message)
+
+            return
+
+        self.remove_request(request)
         self.received_responses += 1
 
+        # Round-trip time is measured from the first attempt, or from
+        # its scheduled time in open-loop mode
+        self.command.stats.latency.record(_time.time() - request.send_time)
+
         out = list()
 
         if not self.command.prefix_disabled:
-            sender = self.senders_by_receiver[event.link]
-            prefix = sender.target.address + ": "
+            prefix = request.sender.target.address + ": "
             out.append(prefix)
 
         if self.command.json_enabled:
-            data = convert_message_to_data(message)
-            json = _json.dumps(data)
-            out.append(json)
+            out.append(self.command.codec.encode(message))
         else:
-            out.append(message.body)
+            out.append(format_body(message.body))
 
         self.command.output_thread.push_line("".join(out))
 
-        self.command.info("Received response {} from {} on {}",
-                          event.message,
-                          event.link.source,
-                          event.connection)
+        if self.command.verbose:
+            self.command.info("Received response {} from {} on {}",
+                              event.message,
+                              event.link.source,
+                              event.connection)
+
+        self.check_done(event)
+        self.send_messages(event)
 
-        if self.done_sending and self.sent_requests == self.received_responses:
+    def check_done(self, event):
+        if self.done_receiving:
+            return
+
+        if self.done_sending and not self.outstanding:
             self.command.output_thread.push_line(DONE)
             self.done_receiving = True
             self.close(event)
@@ -213,3 +492,16 @@ class _Handler(LinkHandler):
                             plural("request", self.sent_requests),
                             self.received_responses,
                             plural("response", self.received_responses))
+
+        if self.command.timeout is not None:
+            self.command.notice("Retried {} {} and gave up on {} after timeout",
+                                self.retried_requests,
+                                plural("request", self.retried_requests),
+                                self.timed_out_requests)
+
+        if self.late_responses:
+            self.command.notice("Ignored {} late or unmatched {}",
+                                self.late_responses,
+                                plural("response", self.late_responses))
+
+        self.command.report_latency("Round-trip")
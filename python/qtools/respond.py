@@ -23,14 +23,25 @@ from __future__ import print_function
 from __future__ import unicode_literals
 from __future__ import with_statement
 
+import collections as _collections
+import functools as _functools
+import inspect as _inspect
 import proton as _proton
 import proton.handlers as _handlers
 import proton.reactor as _reactor
+import os as _os
 import runpy as _runpy
+import signal as _signal
 import sys as _sys
+import threading as _threading
+import time as _time
 import traceback as _traceback
 
 from .common import *
+from .common import _binary_types
+
+_asyncio = lazy_import("asyncio")
+_futures = lazy_import("concurrent.futures")
 
 _description = "Respond to AMQP requests"
 
@@ -44,9 +55,50 @@ processing configuration:
   The request and response arguments are Proton message objects.  The
   return value is ignored.
 
+  To process requests in batches, define this function instead:
+
+    def process_batch(requests, responses):
+        for request, response in zip(requests, responses):
+            response.body = request.body.upper()
+
+  qrespond collects up to --batch-size requests, waiting at most
+  --batch-wait milliseconds, then sends all the responses and settles
+  all the deliveries together.  If processing fails, the whole batch
+  is rejected.
+
+  Either function may be a coroutine (async def).  qrespond then runs
+  an asyncio event loop next to the AMQP reactor, keeps up to
+  --concurrency requests (or batches) in progress, and sends and
+  settles responses as they finish.
+
+  With --cache-size, responses are cached by request body, subject, and
+  any --cache-property values.  A repeated request gets a copy of the
+  cached response without calling process, so use it only with
+  handlers whose output depends on those fields alone.
+
+  With --reload, qrespond reloads the config file when it changes or
+  when it receives SIGHUP.  The new code is loaded on a background
+  thread and swapped in between requests, keeping links and credit
+  intact.  If loading fails, the old code stays in place.
+
+reply routing:
+  By default, responses go out on one anonymous sender per connection,
+  and the broker routes each one by its address.  With --reply-senders,
+  qrespond opens a dedicated sender for each reply address instead,
+  keeping up to COUNT of them open per run and closing the least
+  recently used or idle ones.
+
+  With --workers, requests are processed concurrently in a thread or
+  process pool, and responses are sent as they complete, possibly out
+  of order.  Process pool workers load the config file themselves.
+
 example usage:
   $ qrespond //example.net/queue0
   $ qrespond queue0 queue1
+  $ qrespond queue0 --config slow.py --workers 8
+  $ qrespond queue0 --config cpu.py --workers 4 --pool process
+  $ qrespond queue0 --config scoring.py --batch-size 64 --batch-wait 5
+  $ qrespond queue0 --config lookup.py --cache-size 10000 --cache-ttl 60
 """
 
 class RespondCommand(MessagingCommand):
@@ -62,74 +114,568 @@ class RespondCommand(MessagingCommand):
                           help="Exit after processing COUNT requests")
         self.add_argument("--config", metavar="FILE",
                           help="Load processing code from FILE")
+        self.add_argument("--reload", action="store_true",
+                          help="Reload the config file when it changes or on SIGHUP")
         self.add_argument("--upper", action="store_true",
                           help="Convert the request text to upper case")
         self.add_argument("--reverse", action="store_true",
                           help="Reverse the request text")
         self.add_argument("--append", metavar="STRING",
                           help="Append STRING to the request text")
+        self.add_argument("--workers", metavar="COUNT", type=int,
+                          help="Process up to COUNT requests concurrently")
+        self.add_argument("--pool", metavar="KIND", choices=("thread", "process"), default="thread",
+                          help="Run workers as threads or processes (default thread)")
+        self.add_argument("--concurrency", metavar="COUNT", type=int, default=100,
+                          help="Keep up to COUNT async process calls in progress (default 100)")
+        self.add_argument("--batch-size", metavar="COUNT", type=int, default=100,
+                          help="Pass up to COUNT requests to process_batch (default 100)")
+        self.add_argument("--batch-wait", metavar="MILLISECONDS", type=float, default=10,
+                          help="Wait at most MILLISECONDS to fill a batch (default 10)")
+        self.add_argument("--reply-senders", metavar="COUNT", type=int,
+                          help="Send responses on up to COUNT cached senders, one per reply address")
+        self.add_argument("--reply-sender-idle", metavar="SECONDS", type=float, default=60,
+                          help="Close reply senders unused for SECONDS (default 60)")
+        self.add_argument("--cache-size", metavar="COUNT", type=int,
+                          help="Cache up to COUNT responses and reuse them for repeated requests")
+        self.add_argument("--cache-ttl", metavar="SECONDS", type=float,
+                          help="Expire cached responses after SECONDS (default never)")
+        self.add_argument("--cache-property", metavar="NAME", action="append", default=list(),
+                          help="Include request property NAME in the cache key.  This option can be repeated.")
 
     def init(self):
         super(RespondCommand, self).init()
 
         self.init_link_attributes()
 
-        if self.args.config is not None:
-            config_file = self.args.config
+        self.config_file = self.args.config
 
-            if config_file == "-":
-                config_file = "/dev/stdin"
+        if self.config_file == "-":
+            self.config_file = "/dev/stdin"
 
-            try:
-                config = _runpy.run_path(config_file)
-            except:
-                self.fail("Failed to load config from '{}'", config_file)
+        self.process_batch = None
 
+        if self.config_file is not None:
             try:
-                self.process = config["process"]
+                process, self.process_batch = _load_config(self.config_file)
             except KeyError:
-                self.fail("Function 'process' not found in '{}'", config_file)
+                self.fail("Function 'process' or 'process_batch' not found in '{}'", self.config_file)
+            except:
+                self.fail("Failed to load config from '{}'", self.config_file)
+
+            if process is not None:
+                self.process = process
+
+        self.reload_enabled = self.args.reload
+        self.reloaded = _collections.deque()
+        self.config_mtime = None
+
+        if self.reload_enabled:
+            if self.config_file is None:
+                self.fail("The --reload option requires --config")
+
+            if self.config_file == "/dev/stdin":
+                self.fail("Can't reload the config from stdin")
+
+            self.config_mtime = _os.stat(self.config_file).st_mtime
 
         self.max_count = self.args.count
         self.upper = self.args.upper
         self.reverse = self.args.reverse
         self.append = self.args.append
+        self.workers = self.args.workers
+        self.pool_kind = self.args.pool
+        self.pool = None
+        self.concurrency = self.args.concurrency
+        self.asyncio_loop = None
+        self.cache = None
+        self.reply_senders = None
+
+        if self.args.reply_senders is not None:
+            if self.args.reply_senders < 1:
+                self.fail("The reply sender count must be at least 1")
+
+            if self.args.reply_sender_idle <= 0:
+                self.fail("The reply sender idle time must be greater than zero")
+
+            self.reply_senders = ReplySenderCache(self,
+                                                  self.args.reply_senders,
+                                                  self.args.reply_sender_idle)
+
+        if self.args.cache_size is not None:
+            if self.args.cache_size < 1:
+                self.fail("The cache size must be at least 1")
+
+            if self.args.cache_ttl is not None and self.args.cache_ttl <= 0:
+                self.fail("The cache TTL must be greater than zero")
+
+            self.cache = ResponseCache(self.args.cache_size,
+                                       self.args.cache_ttl,
+                                       self.args.cache_property)
+        elif self.args.cache_ttl is not None or self.args.cache_property:
+            self.fail("The cache options require --cache-size")
+
+        # Without batching, each unit of work is one request
+        self.batch_size = 1
+        self.batch_wait = self.args.batch_wait / 1000
+
+        if self.process_batch is not None:
+            self.batch_size = self.args.batch_size
+
+            if self.batch_size < 1:
+                self.fail("The batch size must be at least 1")
+
+            if self.batch_wait <= 0:
+                self.fail("The batch wait must be greater than zero")
+
+        # Without a pool, keep the usual prefetch window (or enough
+        # to fill a batch).  With one, cap credit at the pool's
+        # capacity so the backlog of unprocessed requests stays
+        # bounded.
+
+        self.credit_window = max(10, self.batch_size)
+
+        if _is_coroutine_function(self.process_batch or self.process):
+            if self.workers is not None:
+                self.fail("The --workers option can't be used with async process functions")
+
+            if self.concurrency < 1:
+                self.fail("The concurrency limit must be at least 1")
+
+            try:
+                self.asyncio_loop = _asyncio.new_event_loop()
+            except ImportError:
+                self.fail("Async process functions require the asyncio module")
+
+            self.credit_window = max(1, self.concurrency * self.batch_size // len(self.urls))
+
+        if self.workers is not None:
+            if self.workers < 1:
+                self.fail("The worker count must be at least 1")
+
+            self.credit_window = max(1, self.workers * self.batch_size // len(self.urls))
+
+            if self.pool_kind == "process" and self.config_file == "/dev/stdin":
+                self.fail("A process pool can't load the config from stdin")
+
+            try:
+                self.pool = self.create_pool()
+            except ImportError:
+                self.fail("The --workers option requires the concurrent.futures module")
+
+    def create_pool(self):
+        if self.pool_kind == "process":
+            initargs = self.config_file, self.upper, self.reverse, self.append
+
+            return _futures.ProcessPoolExecutor(self.workers,
+                                                initializer=_init_worker,
+                                                initargs=initargs)
+
+        return _futures.ThreadPoolExecutor(self.workers)
+
+    def run(self):
+        if self.asyncio_loop is not None:
+            thread = _threading.Thread(target=self.asyncio_loop.run_forever)
+            thread.daemon = True
+            thread.start()
+
+        if self.reload_enabled:
+            _signal.signal(_signal.SIGHUP, lambda signum, frame: self.start_reload())
+
+        super(RespondCommand, self).run()
+
+    def start_reload(self):
+        # Load on a background thread, then swap on the reactor thread
+        thread = _threading.Thread(target=self._load_for_reload)
+        thread.daemon = True
+        thread.start()
+
+    def _load_for_reload(self):
+        try:
+            functions = _load_config(self.config_file)
+        except:
+            functions = None
+            _traceback.print_exc()
+
+        self.reloaded.append(functions)
+        self.events.trigger(_reactor.ApplicationEvent("reload"))
+
+    def swap_functions(self, functions):
+        if functions is None:
+            self.warn("Failed to reload config from '{}'", self.config_file)
+            return
+
+        process, process_batch = functions
+
+        # The batching and async modes set the credit window and the
+        # asyncio loop at startup, so they can't change on reload
+
+        if (process_batch is None) != (self.process_batch is None) \
+           or _is_coroutine_function(process_batch or process) != (self.asyncio_loop is not None):
+            self.warn("Ignored reloaded config from '{}': its process functions are of a different kind",
+                      self.config_file)
+            return
+
+        if process is not None:
+            self.process = process
+
+        self.process_batch = process_batch
+
+        if self.pool is not None and self.pool_kind == "process":
+            # Workers load the config themselves, so start fresh ones
+            # and let the old ones finish their work
+            pool, self.pool = self.pool, self.create_pool()
+            pool.shutdown(wait=False)
+
+        self.notice("Reloaded config from '{}'", self.config_file)
 
     def process(self, request, response):
-        text = request.body
+        _transform_text(self.upper, self.reverse, self.append, request, response)
+
+    def process_requests(self, requests):
+        return _process_requests(self.process, self.process_batch, requests)
 
-        if text is None:
+    def process_requests_async(self, requests):
+        # Returns a concurrent future completed on the asyncio thread.
+        # The functions are captured here so a reload can't change
+        # them mid-request.
+
+        future = _futures.Future()
+        self.asyncio_loop.call_soon_threadsafe(self._start_async,
+                                               self.process,
+                                               self.process_batch,
+                                               requests,
+                                               future)
+
+        return future
+
+    def _start_async(self, process, process_batch, requests, future):
+        responses = [create_response(x) for x in requests]
+
+        def done(task):
+            if task.cancelled():
+                future.cancel()
+            elif task.exception() is not None:
+                future.set_exception(task.exception())
+            else:
+                future.set_result(responses)
+
+        try:
+            if process_batch is not None:
+                awaitable = process_batch(requests, responses)
+            else:
+                awaitable = _asyncio.gather(*[process(x, y) for x, y in zip(requests, responses)])
+
+            task = _asyncio.ensure_future(awaitable, loop=self.asyncio_loop)
+        except Exception as e:
+            future.set_exception(e)
             return
 
-        if self.upper:
-            text = text.upper()
+        task.add_done_callback(done)
+
+def _process_requests(process, process_batch, requests):
+    responses = [create_response(x) for x in requests]
+
+    if process_batch is not None:
+        process_batch(requests, responses)
+    else:
+        for request, response in zip(requests, responses):
+            process(request, response)
+
+    return responses
+
+class ResponseCache(object):
+    """
+    An LRU cache of encoded responses, keyed by request body, subject,
+    and selected properties.  Entries older than the TTL are dropped
+    on lookup.
+    """
+
+    def __init__(self, capacity, ttl=None, properties=()):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.properties = tuple(properties)
+
+        # Key -> (expiry time, encoded response), oldest first
+        self.entries = _collections.OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def key(self, request):
+        body = request.body
+
+        # Binary bodies arrive as writable memoryviews, which can't
+        # be hashed
+        if isinstance(body, (bytearray, memoryview)):
+            body = memoryview(body).tobytes()
+
+        properties = request.properties or dict()
+        values = [properties.get(x) for x in self.properties]
+        key = body, request.subject, tuple(values)
+
+        try:
+            hash(key)
+        except (TypeError, ValueError):
+            # Key lists, maps, and binary properties on their encoded
+            # content
+            key = _proton.Message(body=[body, request.subject, values]).encode()
+
+        return key
+
+    def get(self, request):
+        """Return a copy of the cached response addressed to the requester, or None"""
+
+        key = self.key(request)
+        entry = self.entries.pop(key, None)
+
+        if entry is not None and entry[0] is not None and entry[0] <= _time.time():
+            self.expirations += 1
+            entry = None
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        # Reinsert to mark it most recently used
+        self.entries[key] = entry
+        self.hits += 1
+
+        response = _proton.Message()
+        response.decode(entry[1])
+        response.address = request.reply_to
+        response.correlation_id = request.id
+
+        return response
+
+    def put(self, request, response):
+        expiry = None
+
+        if self.ttl is not None:
+            expiry = _time.time() + self.ttl
+
+        key = self.key(request)
+
+        self.entries.pop(key, None)
+        self.entries[key] = expiry, response.encode()
+
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+class ReplySenderCache(object):
+    """
+    Dedicated senders for reply addresses, keyed by connection and
+    address.  The least recently used sender is closed when the cache
+    is full, and senders idle longer than the idle time are closed by
+    expire().  Senders with deliveries still queued or unsettled are
+    kept open until they drain.
+    """
+
+    def __init__(self, command, capacity, idle_time):
+        self.command = command
+        self.capacity = capacity
+        self.idle_time = idle_time
+
+        # (connection, address) -> [sender, last use time], oldest first
+        self.entries = _collections.OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.closed = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, connection, address):
+        key = connection, address
+        entry = self.entries.pop(key, None)
+
+        if entry is None:
+            self.misses += 1
+            entry = [self.command.container.create_sender(connection, address), None]
+        else:
+            self.hits += 1
+
+        entry[1] = _time.time()
+        self.entries[key] = entry
+
+        if len(self.entries) > self.capacity:
+            self.evict()
+
+        return entry[0]
+
+    def evict(self):
+        for key, entry in list(self.entries.items())[:-1]:
+            if _drained(entry[0]):
+                self._close(key)
+                return
+
+    def expire(self, now):
+        for key, entry in list(self.entries.items()):
+            if entry[1] > now - self.idle_time:
+                break
+
+            if _drained(entry[0]):
+                self._close(key)
 
-        if self.reverse:
-            text = "".join(reversed(text))
+    def close(self):
+        for key in list(self.entries):
+            self._close(key)
 
-        if self.append is not None:
-            text += self.append
+    def _close(self, key):
+        sender = self.entries.pop(key)[0]
+        sender.close()
 
+        self.closed += 1
+
+    def queued(self):
+        return sum(x[0].queued for x in self.entries.values())
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return round(100 * self.hits / lookups, 1) if lookups else 0.0
+
+def _is_coroutine_function(function):
+    # Coroutine functions are new in Python 3.5
+    check = getattr(_inspect, "iscoroutinefunction", None)
+    return check is not None and check(function)
+
+def _drained(sender):
+    return sender.queued == 0 and sender.unsettled == 0
+
+def create_response(request):
+    response = _proton.Message()
+    response.address = request.reply_to
+    response.correlation_id = request.id
+
+    return response
+
+def _transform_text(upper, reverse, append, request, response):
+    text = request.body
+
+    if text is None:
+        return
+
+    # Binary bodies are echoed unchanged
+
+    if isinstance(text, _binary_types):
         response.body = text
+        return
+
+    if upper:
+        text = text.upper()
+
+    if reverse:
+        text = "".join(reversed(text))
+
+    if append is not None:
+        text += append
+
+    response.body = text
+
+def _load_config(config_file):
+    config = _runpy.run_path(config_file)
+
+    process = config.get("process")
+    process_batch = config.get("process_batch")
+
+    if process is None and process_batch is None:
+        raise KeyError("process")
+
+    return process, process_batch
+
+# Process pool workers can't share the parent's process function, so
+# each one rebuilds it from the config file or the text options.
+# Requests and responses cross the process boundary encoded.
+
+_worker_process = None
+_worker_process_batch = None
+
+def _init_worker(config_file, upper, reverse, append):
+    global _worker_process, _worker_process_batch
+
+    if config_file is not None:
+        _worker_process, _worker_process_batch = _load_config(config_file)
+    else:
+        _worker_process = _functools.partial(_transform_text, upper, reverse, append)
+
+def _process_in_worker(data):
+    requests = list()
+
+    for item in data:
+        request = _proton.Message()
+        request.decode(item)
+        requests.append(request)
+
+    responses = _process_requests(_worker_process, _worker_process_batch, requests)
+
+    return [x.encode() for x in responses]
 
 class _Handler(LinkHandler):
     def __init__(self, command):
-        super(_Handler, self).__init__(command, auto_accept=False)
+        super(_Handler, self).__init__(command, auto_accept=False, prefetch=0)
 
         self.receivers = list()
-        self.senders_by_receiver = dict()
+        self.senders_by_connection = dict()
+
+        # Requests waiting to be processed together
+        self.batch = list()
+
+        # Completed pool work, filled by worker callbacks and drained
+        # on the reactor thread
+        self.results = _collections.deque()
 
         self.processed_requests = 0
 
+    def on_start(self, event):
+        super(_Handler, self).on_start(event)
+
+        if self.command.batch_size > 1:
+            self.start_timer(event, self.command.batch_wait, self.dispatch_batch)
+
+        if self.command.reload_enabled:
+            self.start_timer(event, 1, self.check_config)
+
+        reply_senders = self.command.reply_senders
+
+        if reply_senders is not None:
+            interval = min(reply_senders.idle_time / 2, 1)
+            self.start_timer(event, interval, lambda event: reply_senders.expire(_time.time()))
+
     def open_links(self, event, connection, address):
         receiver = event.container.create_receiver(connection, address)
-        sender = event.container.create_sender(connection, None)
+        receiver.flow(self.command.credit_window)
 
         self.receivers.append(receiver)
-        self.senders_by_receiver[receiver] = sender
+
+        # Receivers on the same connection share one anonymous sender
+        # for responses
+
+        if connection in self.senders_by_connection:
+            return receiver,
+
+        sender = event.container.create_sender(connection, None)
+
+        self.senders_by_connection[connection] = sender
 
         return receiver, sender
 
+    def on_link_opened(self, event):
+        # Reply senders come and go outside the startup links
+
+        if event.link not in self.links:
+            if self.command.verbose:
+                self.command.info("Created reply sender for {} on {}",
+                                  event.link.target,
+                                  event.connection)
+
+            return
+
+        super(_Handler, self).on_link_opened(event)
+
     def on_message(self, event):
         if self.done_receiving:
             return
@@ -138,32 +684,136 @@ class _Handler(LinkHandler):
         request = event.message
         receiver = event.link
 
-        self.command.info("Received request {} from {} on {}",
-                          request,
-                          receiver.source,
-                          event.connection)
+        if self.command.verbose:
+            self.command.info("Received request {} from {} on {}",
+                              request,
+                              receiver.source,
+                              event.connection)
 
-        response = _proton.Message()
-        response.address = request.reply_to
-        response.correlation_id = request.id
+        cache = self.command.cache
+
+        if cache is not None:
+            response = cache.get(request)
+
+            if response is not None:
+                self.finish_request(event, delivery, request, response)
+                return
+
+        self.batch.append((delivery, request))
+
+        if len(self.batch) >= self.command.batch_size:
+            self.dispatch_batch(event)
+
+    def dispatch_batch(self, event):
+        if not self.batch or self.done_receiving:
+            return
+
+        items = self.batch
+        requests = [x[1] for x in items]
+        pool = self.command.pool
+
+        self.batch = list()
+
+        if self.command.asyncio_loop is not None:
+            future = self.command.process_requests_async(requests)
+            future.add_done_callback(_functools.partial(self.on_result, items))
+
+            return
+
+        if pool is not None:
+            if self.command.pool_kind == "process":
+                future = pool.submit(_process_in_worker, [x.encode() for x in requests])
+            else:
+                future = pool.submit(_process_requests,
+                                     self.command.process,
+                                     self.command.process_batch,
+                                     requests)
+
+            future.add_done_callback(_functools.partial(self.on_result, items))
+
+            return
 
         try:
-            self.command.process(request, response)
-            processing_succeeded = True
+            responses = self.command.process_requests(requests)
         except:
-            processing_succeeded = False
+            responses = None
             _traceback.print_exc()
 
+        self.finish_batch(event, items, responses)
+
+    def check_config(self, event):
+        try:
+            mtime = _os.stat(self.command.config_file).st_mtime
+        except OSError:
+            return
+
+        if mtime != self.command.config_mtime:
+            self.command.config_mtime = mtime
+            self.command.start_reload()
+
+    def on_reload(self, event):
+        while self.command.reloaded:
+            self.command.swap_functions(self.command.reloaded.popleft())
+
+    def on_result(self, items, future):
+        # Called on a worker or asyncio thread
+        self.results.append((items, future))
+
+        if not self.done_receiving:
+            self.command.events.trigger(_reactor.ApplicationEvent("processed"))
+
+    def on_processed(self, event):
+        while self.results and not self.done_receiving:
+            items, future = self.results.popleft()
+            error = future.exception()
+
+            if error is None:
+                responses = future.result()
+            else:
+                responses = None
+
+                # Python 2 exceptions carry no traceback
+                tb = getattr(error, "__traceback__", None)
+                _traceback.print_exception(type(error), error, tb)
+
+            self.finish_batch(event, items, responses)
+
+    def finish_batch(self, event, items, responses):
+        if responses is None:
+            responses = [None] * len(items)
+
+        cache = self.command.cache
+
+        if cache is not None:
+            for (delivery, request), response in zip(items, responses):
+                if response is not None:
+                    cache.put(request, response)
+
+        for (delivery, request), response in zip(items, responses):
+            if self.done_receiving:
+                break
+
+            self.finish_request(event, delivery, request, response)
+
+    def finish_request(self, event, delivery, request, response):
+        receiver = delivery.link
+
         self.processed_requests += 1
 
-        if processing_succeeded:
-            sender = self.senders_by_receiver[event.link]
-            sender.send(response)
+        if response is not None:
+            sender = self.senders_by_connection[receiver.connection]
+            reply_senders = self.command.reply_senders
 
-            self.command.info("Sent response {} to {} on {}",
-                              response,
-                              sender.target,
-                              event.connection)
+            if reply_senders is not None and response.address is not None:
+                sender = reply_senders.get(receiver.connection, response.address)
+
+            self.transfer(sender, response)
+
+            if self.command.verbose:
+                self.command.info("Sent response {} to {} on {}",
+                                  response,
+                                  sender.target,
+                                  sender.connection)
 
             self.accept(delivery)
         else:
@@ -171,13 +821,89 @@ class _Handler(LinkHandler):
 
             self.reject(delivery)
 
+        receiver.flow(1)
+
         if self.processed_requests == self.command.max_count:
             self.done_receiving = True
-            self.close(event)
+            self.check_done(event)
+
+    def on_sendable(self, event):
+        if self.resends:
+            self.resend_messages()
+
+        self.check_done(event)
+
+    def on_settled(self, event):
+        super(_Handler, self).on_settled(event)
+
+        self.check_done(event)
+
+    def check_done(self, event):
+        # Responses on reply senders that are still attaching would be
+        # lost if the connection closed now
+
+        if not self.done_receiving or self.done_sending:
+            return
+
+        reply_senders = self.command.reply_senders
+
+        if reply_senders is not None and reply_senders.queued():
+            return
+
+        # Likewise responses waiting to be resent after a reconnect
+        if self.resends:
+            return
+
+        self.done_sending = True
+        self.close(event)
+
+    def stats_counters(self):
+        cache = self.command.cache
+        reply_senders = self.command.reply_senders
+
+        counters = _collections.OrderedDict()
+
+        if cache is not None:
+            counters["cache_hits"] = cache.hits
+            counters["cache_misses"] = cache.misses
+            counters["cache_evictions"] = cache.evictions
+            counters["cache_expirations"] = cache.expirations
+
+        if reply_senders is not None:
+            counters["reply_sender_hit_rate"] = reply_senders.hit_rate()
+            counters["open_links"] = len(self.links) + len(reply_senders)
+
+        return counters
 
     def close(self, event):
+        if self.command.reply_senders is not None:
+            self.command.reply_senders.close()
+
         super(_Handler, self).close(event)
 
+        if self.command.pool is not None:
+            self.command.pool.shutdown(wait=False)
+
+        if self.command.asyncio_loop is not None:
+            self.command.asyncio_loop.call_soon_threadsafe(self.command.asyncio_loop.stop)
+
         self.command.notice("Processed {} {}",
                             self.processed_requests,
                             plural("request", self.processed_requests))
+
+        cache = self.command.cache
+
+        if cache is not None:
+            self.command.notice("Cache hits {}, misses {}, evictions {}, expirations {}",
+                                cache.hits,
+                                cache.misses,
+                                cache.evictions,
+                                cache.expirations)
+
+        reply_senders = self.command.reply_senders
+
+        if reply_senders is not None:
+            self.command.notice("Reply sender hit rate {}%, {} {} opened",
+                                reply_senders.hit_rate(),
+                                reply_senders.misses,
+                                plural("sender", reply_senders.misses))